@@ -0,0 +1,294 @@
+import sys, os, json, time, argparse, tempfile, subprocess, platform, random
+START = time.perf_counter()
+
+# Headless benchmarks for the output pipeline: shell -> ProcessManager reader -> ANSI parser ->
+# output queue -> AerominalApp frames, under Qt's offscreen platform.
+# Each workload runs in its own process with its own HOME, so peak RSS and startup are per run:
+#   python benchmarks/bench.py [-w plain sgr ...] [--scale 0.5] [-o out.json] [--baseline old.json]
+# --sessions N also opens N tabs in one window and reports what each session adds in threads,
+# file descriptors and RSS.
+# With --baseline, runs that lose more than --tolerance of throughput, or gain as much in p95
+# frame time, are listed as regressions and the exit status is 1.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MARKER = '__aerominal_bench_done__'
+CHUNK = 64 << 10
+
+# name -> (description, generator of the output text at a given scale)
+def plain(scale):
+    words = 'the quick brown fox jumps over a lazy dog while aerominal keeps up'.split()
+    rnd = random.Random(1)
+    return ''.join(' '.join(rnd.choice(words) for _ in range(12)) + f' {i}\n' for i in range(int(200000 * scale)))
+
+def sgr(scale):
+    rnd = random.Random(2)
+    lines = []
+    for i in range(int(100000 * scale)):
+        cells = (f'\x1b[{rnd.choice((1, 2, 3, 4, 7))};38;5;{rnd.randrange(256)};48;5;{rnd.randrange(256)}mcell{j}\x1b[0m' for j in range(10))
+        lines.append(' '.join(cells) + '\n')
+    return ''.join(lines)
+
+def progress(scale):
+    n = int(100000 * scale)
+    bars = (f'\r\x1b[K{i * 100 // n:3d}% [{"#" * (i * 40 // n):<40}] {i}/{n}' for i in range(n))
+    return ''.join(bars) + '\n'
+
+def long_lines(scale):
+    return ''.join(f'{i}:' + 'x' * 20000 + '\n' for i in range(max(int(500 * scale), 1)))
+
+def scrollback(scale):
+    return ''.join(f'line {i}\n' for i in range(int(2000000 * scale)))
+
+WORKLOADS = {
+    'plain': ('plain text flood', plain),
+    'sgr': ('dense SGR colours and attributes', sgr),
+    'progress': ('carriage-return progress bar', progress),
+    'long_lines': ('20k-character lines', long_lines),
+    'scrollback': ('short lines far past the scrollback limit', scrollback),
+}
+
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+def peak_rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+    except ImportError:
+        import ctypes, ctypes.wintypes
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', ctypes.wintypes.DWORD), ('PageFaultCount', ctypes.wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in ('PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                                                             'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        c = Counters(cb=ctypes.sizeof(Counters))
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(c), c.cb)
+        return c.PeakWorkingSetSize / (1 << 20)
+
+
+def rss_mb():
+    # Current rather than peak, so memory taken by sessions opened later shows up as growth
+    try:
+        with open('/proc/self/statm') as f: return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+    except OSError: return peak_rss_mb()
+
+def os_threads():
+    try:
+        with open('/proc/self/status') as f: return next(int(line.split()[1]) for line in f if line.startswith('Threads:'))
+    except OSError:
+        import threading
+        return threading.active_count()
+
+# Notes when MARKER comes through the shell's output; the marker can arrive split across reads
+def watch(pm):
+    seen = {'tail': '', 'at': None}
+    emit = pm._emit
+    def watched(text, **kwargs):
+        tail = seen['tail'] + (text or '')
+        if seen['at'] is None and MARKER in tail: seen['at'] = time.perf_counter()
+        seen['tail'] = tail[-len(MARKER):]
+        return emit(text, **kwargs)
+    pm._emit = watched
+    return seen
+
+
+# Parser alone, in the chunk size the readers use
+def parse_rate(text):
+    sys.path.insert(0, ROOT)
+    from src.core.ansi_parser import ANSIStream
+    parser = ANSIStream()
+    t = time.perf_counter()
+    for i in range(0, len(text), CHUNK): parser.feed(text[i:i + CHUNK])
+    return len(text.encode('utf-8')) / (time.perf_counter() - t) / 1e6
+
+
+# Has the shell of a fresh window cat `path` and measures until the last frame is drawn
+def run_one(path, timeout):
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt6.QtWidgets import QApplication
+    from src.core.config_manager import ConfigManager
+    from src.core.process_manager import create_process_manager
+    from src.ui.app import AerominalApp
+
+    app = QApplication(sys.argv[:1])
+    cfg = ConfigManager()
+    pm = create_process_manager(cfg)
+    seen = watch(pm)
+    w = AerominalApp(cfg, pm)
+    w.run()
+    # Frame times are taken around every update_output call
+    session, frame_times = w.session, []
+    update = session.update_output
+    def timed(budget=None):
+        t = time.perf_counter()
+        update(budget)
+        frame_times.append((time.perf_counter() - t) * 1000)
+    session.update_output = timed
+
+    def round_trip(cmd):
+        seen['at'], seen['tail'] = None, ''
+        frame_times.clear()
+        t = time.perf_counter()
+        pm.write(f"{cmd}; echo {MARKER}")
+        while time.perf_counter() - t < timeout:
+            app.processEvents()
+            if seen['at'] is not None and pm.output_queue.empty() and not w.scheduler.timer.isActive(): return t, True
+            time.sleep(0.001)
+        return t, False
+
+    _, ok = round_trip('true')
+    if not ok: raise RuntimeError('shell did not answer')
+    startup = time.perf_counter() - START
+    t, ok = round_trip(f'{"type" if os.name == "nt" else "cat"} "{path}"')
+    elapsed = time.perf_counter() - t
+    read = (seen['at'] or time.perf_counter()) - t
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f: lines = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+    frames = frame_times
+    result = {
+        'completed': ok,
+        'bytes': size, 'lines': lines,
+        'seconds': round(elapsed, 4),
+        'mb_per_s': round(size / elapsed / 1e6, 3),
+        'lines_per_s': round(lines / elapsed),
+        'read_seconds': round(read, 4),
+        'frames': len(frames),
+        'frame_ms': {'p50': round(percentile(frames, 50), 3), 'p95': round(percentile(frames, 95), 3),
+                     'p99': round(percentile(frames, 99), 3), 'max': round(max(frames, default=0), 3)},
+        'skipped_bytes': pm.output_queue.stats()['skipped_bytes'],
+        'startup_ms': round(startup * 1000, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+    pm.stop()
+    return result
+
+
+# Opens `count` sessions as tabs of one window, waiting for each shell to answer, and reports what
+# every session past the first adds in threads, file descriptors and memory
+def run_sessions(count, timeout):
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt6.QtWidgets import QApplication
+    from src.core.config_manager import ConfigManager
+    from src.core.process_manager import create_process_manager
+    from src.ui.app import AerominalApp
+
+    app = QApplication(sys.argv[:1])
+    cfg = ConfigManager()
+    def answered(pm, seen):
+        t = time.perf_counter()
+        pm.write(f"echo {MARKER}")
+        while seen['at'] is None:
+            if time.perf_counter() - t > timeout: raise RuntimeError('shell did not answer')
+            app.processEvents()
+            time.sleep(0.001)
+        return seen['at'] - t
+
+    pm = create_process_manager(cfg)
+    seen = watch(pm)
+    w = AerominalApp(cfg, pm)
+    w.run()
+    answered(pm, seen)
+    fds = lambda: len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else 0
+    base = (os_threads(), fds(), rss_mb())
+    t = time.perf_counter()
+    for _ in range(count - 1):
+        pm = create_process_manager(cfg)
+        seen = watch(pm)
+        w.new_tab(pm)
+        answered(pm, seen)
+    elapsed = time.perf_counter() - t
+    added = max(count - 1, 1)
+    result = {
+        'sessions': count,
+        'threads': os_threads(), 'threads_first_session': base[0],
+        'threads_per_session': round((os_threads() - base[0]) / added, 2),
+        'fds_per_session': round((fds() - base[1]) / added, 2),
+        'rss_mb': round(rss_mb(), 1), 'rss_mb_per_session': round((rss_mb() - base[2]) / added, 2),
+        'open_ms_per_session': round(elapsed / added * 1000, 1),
+    }
+    for session in list(w.sessions): w.close_session(session)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, new in results.items():
+        old = baseline.get('results', {}).get(name)
+        if not old or 'error' in new or 'error' in old: continue
+        if new['mb_per_s'] < old['mb_per_s'] * (1 - tolerance):
+            regressions.append(f"{name}: {old['mb_per_s']} -> {new['mb_per_s']} MB/s")
+        if new['frame_ms']['p95'] > old['frame_ms']['p95'] * (1 + tolerance):
+            regressions.append(f"{name}: frame p95 {old['frame_ms']['p95']} -> {new['frame_ms']['p95']} ms")
+    return regressions
+
+
+# Runs this script again with `extra` arguments, in `home` set up for the chosen renderer and backend
+def run_child(args, home, *extra):
+    settings = os.path.join(home, '.aerominal', 'config', 'settings.json')
+    os.makedirs(os.path.dirname(settings))
+    with open(settings, 'w') as f:
+        json.dump({'appearance': {'renderer': args.renderer}, 'behavior': {'backend': args.backend}}, f)
+    env = dict(os.environ, HOME=home, USERPROFILE=home, QT_QPA_PLATFORM='offscreen')
+    cmd = [sys.executable, os.path.abspath(__file__), *extra, '--timeout', str(args.timeout)]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    try: return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return {'error': (proc.stderr.strip().splitlines() or ['no output'])[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless aerominal output pipeline benchmarks')
+    parser.add_argument('-w', '--workloads', nargs='+', choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the size of every workload')
+    parser.add_argument('--renderer', choices=('text', 'grid'), default='text')
+    parser.add_argument('--backend', choices=('pipe', 'pty'), default='pipe')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds allowed per workload')
+    parser.add_argument('-o', '--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--sessions', type=int, metavar='N', help='also measure the overhead of each of N sessions in one window')
+    parser.add_argument('--one', help=argparse.SUPPRESS)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        print(json.dumps(run_one(args.one, args.timeout)))
+        return
+    if args.child:
+        print(json.dumps(run_sessions(args.sessions, args.timeout)))
+        return
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'renderer': args.renderer, 'backend': args.backend, 'scale': args.scale, 'results': {}}
+    for name in args.workloads:
+        with tempfile.TemporaryDirectory() as home:
+            description, generate = WORKLOADS[name]
+            text = generate(args.scale)
+            path = os.path.join(home, f'{name}.txt')
+            with open(path, 'w', encoding='utf-8', newline='') as f: f.write(text)
+            parse = parse_rate(text)
+            del text
+            result = run_child(args, home, '--one', path)
+        report['results'][name] = {'description': description, **result, 'parse_mb_per_s': round(parse, 3)}
+        print(f"{name}: {report['results'][name]}", file=sys.stderr)
+    if args.sessions:
+        with tempfile.TemporaryDirectory() as home: report['sessions'] = run_child(args, home, '--child', '--sessions', str(args.sessions))
+        print(f"sessions: {report['sessions']}", file=sys.stderr)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f: report['regressions'] = compare(report['results'], json.load(f), args.tolerance)
+        status = 1 if report['regressions'] else 0
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(out + '\n')
+    else: print(out)
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
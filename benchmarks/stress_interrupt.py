@@ -0,0 +1,103 @@
+import sys, os, json, time, argparse, tempfile, queue
+from bench import ROOT, MARKER, os_threads
+
+# Stress test for Ctrl+C: interrupts a running job in the same shell again and again, then restarts
+# the shell a few times, on each backend. Headless, without Qt:
+#   python benchmarks/stress_interrupt.py [--interrupts 1000] [--restarts 20] [--backend pipe pty]
+# Fails (exit status 1) if the thread or fd count moved, the shell was replaced by an interrupt, or
+# a variable and the cwd set before the interrupts are gone after them.
+
+def fds():
+    return len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else 0
+
+# Output is taken straight from the output queue, where the window would pick it up
+def drain(pm):
+    text = []
+    while True:
+        try: runs, _, _ = pm.output_queue.get_nowait()
+        except queue.Empty: return ''.join(text)
+        text += [val for val, _ in runs if val is not None]
+
+def answer(pm, cmd, timeout):
+    drain(pm)
+    pm.write(f"{cmd}; echo {MARKER}")
+    out, t = '', time.perf_counter()
+    while MARKER not in out:
+        if time.perf_counter() - t > timeout: raise RuntimeError(f'shell did not answer {cmd!r}')
+        out += drain(pm)
+        time.sleep(0.001)
+    return out[:out.index(MARKER)]
+
+def wait_for(check, timeout):
+    t = time.perf_counter()
+    while not check():
+        if time.perf_counter() - t > timeout: return False
+        time.sleep(0.001)
+    return True
+
+# The job is interrupted once it is sleep itself: a ^C between the shell's fork and the child taking
+# the terminal's foreground still goes to the shell, a window no one can hit by hand
+def job_started(pm):
+    if not os.path.isdir('/proc'): return pm.busy()
+    for pid in pm._children(pm.process.pid):
+        try:
+            with open(f'/proc/{pid}/comm') as f:
+                if f.read().strip() == 'sleep': return True
+        except OSError: pass
+    return False
+
+def run_backend(cfg, backend, args):
+    from src.core.process_manager import ProcessManager, PtyProcessManager
+    pm = (PtyProcessManager if backend == 'pty' else ProcessManager)(cfg)
+    pm.start()
+    failures, interrupt_ms = [], None
+    try:
+        cwd = tempfile.mkdtemp(prefix='aerominal-stress-')
+        answer(pm, f"export AEROMINAL_STRESS=kept; cd '{cwd}'", args.timeout)
+        pid, base = pm.process.pid, (os_threads(), fds())
+        t = time.perf_counter()
+        for i in range(args.interrupts):
+            pm.write('sleep 100')
+            if not wait_for(lambda: job_started(pm), args.timeout): raise RuntimeError(f'job did not start (interrupt {i})')
+            pm.interrupt()
+            if not wait_for(lambda: not pm.busy(), args.timeout): raise RuntimeError(f'job survived interrupt {i}')
+        interrupt_ms = (time.perf_counter() - t) / max(args.interrupts, 1) * 1000
+        after = (os_threads(), fds())
+        state = answer(pm, 'echo "$AEROMINAL_STRESS:$PWD"', args.timeout).strip().splitlines()
+        if pm.process.pid != pid or pm.process.poll() is not None: failures.append('an interrupt replaced the shell')
+        if f'kept:{cwd}' not in state: failures.append(f'shell state lost: {state[-1:] or "no output"}')
+        if after != base: failures.append(f'interrupts: threads {base[0]} -> {after[0]}, fds {base[1]} -> {after[1]}')
+
+        for _ in range(args.restarts):
+            pm.restart()
+            answer(pm, 'true', args.timeout)
+        restarted = (os_threads(), fds())
+        if restarted != base: failures.append(f'restarts: threads {base[0]} -> {restarted[0]}, fds {base[1]} -> {restarted[1]}')
+        os.rmdir(cwd)
+    except RuntimeError as e: failures.append(str(e))
+    finally: pm.stop()
+    return {'interrupts': args.interrupts, 'restarts': args.restarts, 'interrupt_ms': interrupt_ms and round(interrupt_ms, 2),
+            'threads': os_threads(), 'fds': fds(), 'failures': failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Interrupt and restart stress test for the shell backends')
+    parser.add_argument('--interrupts', type=int, default=1000)
+    parser.add_argument('--restarts', type=int, default=20)
+    parser.add_argument('--backend', nargs='+', choices=('pipe', 'pty'), default=['pipe', 'pty'] if os.name != 'nt' else ['pipe'])
+    parser.add_argument('--timeout', type=float, default=10, help='seconds to wait for the shell at each step')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    with tempfile.TemporaryDirectory() as home:
+        os.environ.update(HOME=home, USERPROFILE=home)
+        from src.core.config_manager import ConfigManager
+        cfg = ConfigManager()
+        report = {name: run_backend(cfg, name, args) for name in args.backend}
+        cfg.flush()  # written now, while HOME still exists, so the exit flush has nothing left to do
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if any(r['failures'] for r in report.values()) else 0)
+
+
+if __name__ == '__main__':
+    main()
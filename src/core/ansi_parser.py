@@ -1,24 +1,210 @@
-
 import re
 
+# Styles are packed into one int: flags in bits 0-7, foreground from bit 8, background from bit 34.
+# A color field is 0 for the default color, 1 + index for palette colors and TRUECOLOR | rgb.
+BOLD, DIM, ITALIC, UNDERLINE, BLINK, INVERSE, HIDDEN, STRIKE = (1 << i for i in range(8))
+FG_SHIFT, BG_SHIFT, COLOR_MASK, TRUECOLOR = 8, 34, (1 << 26) - 1, 1 << 25
+DEFAULT_STYLE = 0
+
+BASIC_COLORS = ['black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white',
+                'grey', 'tomato', 'lime', 'gold', 'dodgerblue', 'violet', 'aqua', 'whitesmoke']
+SGR_FLAGS = {1: BOLD, 2: DIM, 3: ITALIC, 4: UNDERLINE, 5: BLINK, 7: INVERSE, 8: HIDDEN, 9: STRIKE}
+SGR_CLEAR = {21: BOLD | DIM, 22: BOLD | DIM, 23: ITALIC, 24: UNDERLINE, 25: BLINK, 27: INVERSE, 28: HIDDEN, 29: STRIKE}
+
+def style_fg(style): return (style >> FG_SHIFT) & COLOR_MASK
+
+def style_bg(style): return (style >> BG_SHIFT) & COLOR_MASK
+
+def color_name(code):
+    if code & TRUECOLOR: return '#%06x' % (code & 0xFFFFFF)
+    idx = code - 1
+    if idx < 16: return BASIC_COLORS[idx]
+    if idx < 232:
+        r, g, b = (((idx - 16) // d) % 6 for d in (36, 6, 1))
+        return '#%02x%02x%02x' % tuple(0 if c == 0 else 55 + c * 40 for c in (r, g, b))
+    level = 8 + (idx - 232) * 10
+    return '#%02x%02x%02x' % (level, level, level)
+
+# Helpers for run lists as returned by ANSIStream.feed
+def runs_size(runs):
+    size = lines = 0
+    for text, _ in runs:
+        if text:
+            size += len(text)
+            lines += text.count('\n')
+    return size, lines
+
+# Splits after about `limit` characters, at a newline where the run allows it
+def split_runs(runs, limit):
+    size = 0
+    for i, (text, style) in enumerate(runs):
+        if text is None: continue
+        if size + len(text) > limit:
+            room = limit - size
+            cut = text.rfind('\n', 0, room) + 1 or room
+            return runs[:i] + [(text[:cut], style)], [(text[cut:], style)] + runs[i + 1:]
+        size += len(text)
+    return runs, []
+
+# The runs holding the last `lines` lines
+def tail_runs(runs, lines):
+    seen = 0
+    for i in range(len(runs) - 1, -1, -1):
+        text = runs[i][0]
+        if not text: continue
+        n = text.count('\n')
+        if seen + n > lines:
+            cut = len(text)
+            for _ in range(lines - seen + 1): cut = text.rfind('\n', 0, cut)
+            rest = text[cut + 1:]
+            return ([(rest, runs[i][1])] if rest else []) + runs[i + 1:]
+        seen += n
+    return runs
+
+
+# Colors for packed styles under one theme: (fg, bg) color names, None for the theme default.
+# Results are cached for the theme's lifetime; a theme change means a new palette.
+class StylePalette:
+    def __init__(self, theme):
+        self.fg, self.bg = theme['text_color'], theme['background']
+        try:
+            bg = self.bg.lstrip('#')
+            self.dark = int(bg[:2], 16) * 0.299 + int(bg[2:4], 16) * 0.587 + int(bg[4:], 16) * 0.114 < 40
+        except ValueError: self.dark = False
+        self.cache = {}
+
+    def resolve(self, style):
+        colors = self.cache.get(style)
+        if colors is None: colors = self.cache[style] = self._resolve(style)
+        return colors
+
+    def _resolve(self, style):
+        fg = color_name(style_fg(style)) if style_fg(style) else None
+        bg = color_name(style_bg(style)) if style_bg(style) else None
+        if style & INVERSE: fg, bg = bg or self.bg, fg or self.fg
+        if style & HIDDEN: fg = bg or self.bg
+        if fg == 'black' and self.dark: fg = 'white'  # keep black text readable on dark themes
+        if style & DIM and not fg: fg = self.fg
+        return fg, bg
+
+
 class ANSIParser:
     ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    COLORS = {'30': 'black', '31': 'red', '32': 'green', '33': 'yellow', '34': 'blue', '35': 'magenta', '36': 'cyan', '37': 'white', '90': 'grey'}
 
     @classmethod
     def strip(cls, text): return cls.ANSI_ESCAPE.sub('', text)
 
     @classmethod
-    def parse(cls, text):
-        parts, last_end = [], 0
-        for match in cls.ANSI_ESCAPE.finditer(text):
-            if match.start() > last_end: parts.append(('text', text[last_end:match.start()]))
-            code = match.group()
-            if code.endswith('m'):
-                nums = re.findall(r'\d+', code)
-                for n in nums:
-                    if n in cls.COLORS: parts.append(('color', cls.COLORS[n]))
-                    elif n == '0': parts.append(('reset', None))
-            last_end = match.end()
-        if last_end < len(text): parts.append(('text', text[last_end:]))
-        return parts
+    def parse(cls, text): return ANSIStream().feed(text)
+
+
+class ANSIStream:
+    # Splitting on TOKENS yields text, then per token: CR/BS/FF, SGR params, other CSI params and final, OSC 7 payload,
+    # then text again. Cursor controls come back as (None, (op, args)) entries between the text runs, and a working
+    # directory report (OSC 7) as (None, ('cwd', (url,))).
+    TOKENS = re.compile(r'([\r\x08\f])|\x1b(?:\[([0-9;:]*)m|\[([0-?]*)[ -/]*([@-~])|\](?:7;([^\x07\x1b]*)|[^\x07\x1b]*)(?:\x07|\x1b\\)|[()*+#%][ -~]|[@-Z\\^_`-~])?')
+    PARTIAL = re.compile(r'\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b]*\x1b?|[()*+#%])?')
+    MAX_PENDING = 4096
+    CURSOR_OPS = frozenset('ABCDEFGHJKf')
+    sgr_cache, op_cache = {}, {}
+
+    def __init__(self):
+        self.style = DEFAULT_STYLE
+        self.pending = ''
+
+    def reset(self):
+        self.style = DEFAULT_STYLE
+        self.pending = ''
+
+    # Returns [(text, style), ...]; escape sequences split across chunks are held until complete
+    def feed(self, text):
+        if self.pending:
+            text, self.pending = self.pending + text, ''
+        cut = self._partial_start(text)
+        if cut >= 0:
+            text, self.pending = text[:cut], text[cut:]
+        parts = self.TOKENS.split(text)
+        style, cache, ops, runs = self.style, self.sgr_cache, self.op_cache, []
+        acc = [parts[0]] if parts[0] else []
+        for i in range(1, len(parts), 6):
+            params = parts[i + 1]
+            if params is not None:
+                new = cache.get((style, params))
+                if new is None:
+                    if len(cache) > 4096: cache.clear()
+                    new = cache[style, params] = self.apply_sgr(style, params)
+                if new != style:
+                    if acc: runs.append((''.join(acc), style))
+                    acc, style = [], new
+            elif parts[i + 4] is not None:
+                if acc: runs.append((''.join(acc), style))
+                acc = []
+                runs.append((None, ('cwd', (parts[i + 4],))))
+            else:
+                op = parts[i] or parts[i + 3]
+                if op is not None:
+                    key = (op, parts[i + 2])
+                    entry = ops.get(key, False)
+                    if entry is False:
+                        if len(ops) > 4096: ops.clear()
+                        entry = ops[key] = self.cursor_op(op, parts[i + 2])
+                    if entry is not None:
+                        if acc: runs.append((''.join(acc), style))
+                        acc = []
+                        runs.append(entry)
+            if parts[i + 5]: acc.append(parts[i + 5])
+        if acc: runs.append((''.join(acc), style))
+        self.style = style
+        return runs
+
+    @classmethod
+    def cursor_op(cls, op, params):
+        if op in '\r\x08\f': return (None, (op, ()))
+        if op not in cls.CURSOR_OPS or params[:1] in ('<', '=', '>', '?'): return None
+        return (None, (op, tuple(int(p) if p.isdigit() else 0 for p in params.split(';')) if params else ()))
+
+    def _partial_start(self, text):
+        floor = max(0, len(text) - self.MAX_PENDING)
+        start = text.rfind('\x1b', floor)
+        if start < 0: return -1
+        if start == len(text) - 1:
+            osc = text.rfind('\x1b]', floor, start)  # ESC may be the first half of an OSC terminator
+            return osc if osc >= 0 and self.PARTIAL.fullmatch(text, osc) else start
+        return start if self.PARTIAL.fullmatch(text, start) else -1
+
+    @classmethod
+    def apply_sgr(cls, style, params):
+        if not params: codes = [0]
+        elif ':' not in params: codes = [int(p) if p.isdigit() else 0 for p in params.split(';')]
+        else:
+            codes = []
+            for p in params.split(';'):
+                sub = p.split(':')
+                if len(sub) > 5 and sub[1] == '2': del sub[2]  # 38:2:<colorspace>:r:g:b
+                codes.extend(int(v) if v.isdigit() else 0 for v in sub)
+        i, n = 0, len(codes)
+        while i < n:
+            c = codes[i]
+            if c == 0: style = DEFAULT_STYLE
+            elif c in SGR_FLAGS: style |= SGR_FLAGS[c]
+            elif c in SGR_CLEAR: style &= ~SGR_CLEAR[c]
+            elif 30 <= c <= 37 or 90 <= c <= 97: style = cls._set_color(style, FG_SHIFT, 1 + c - (30 if c < 90 else 82))
+            elif 40 <= c <= 47 or 100 <= c <= 107: style = cls._set_color(style, BG_SHIFT, 1 + c - (40 if c < 100 else 92))
+            elif c == 39: style = cls._set_color(style, FG_SHIFT, 0)
+            elif c == 49: style = cls._set_color(style, BG_SHIFT, 0)
+            elif c in (38, 48) and i + 1 < n:
+                shift = FG_SHIFT if c == 38 else BG_SHIFT
+                if codes[i + 1] == 5 and i + 2 < n:
+                    style = cls._set_color(style, shift, 1 + (codes[i + 2] & 0xFF))
+                    i += 2
+                elif codes[i + 1] == 2 and i + 4 < n:
+                    r, g, b = (v & 0xFF for v in codes[i + 2:i + 5])
+                    style = cls._set_color(style, shift, TRUECOLOR | (r << 16) | (g << 8) | b)
+                    i += 4
+                else: i = n
+            i += 1
+        return style
+
+    @staticmethod
+    def _set_color(style, shift, code):
+        return (style & ~(COLOR_MASK << shift)) | (code << shift)
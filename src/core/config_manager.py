@@ -1,54 +1,102 @@
 
-import json, os
+import json, os, copy, threading, time, atexit, tempfile
 from pathlib import Path
 from .theme_manager import ThemeManager
 
 class ConfigManager:
+    SAVE_DELAY = 0.5  # seconds of quiet before a burst of changes is written
+
     def __init__(self):
         self.config_dir = Path.home() / '.aerominal'
         self.config_file = self.config_dir / 'config' / 'settings.json'
         self.default_config = {
             'window': {'opacity': 0.75, 'width': 950, 'height': 600, 'always_on_top': False, 'start_maximized': False},
-            'appearance': {'theme': 'dark', 'font_family': 'Consolas', 'font_size': 11, 'show_ansi_colors': True},
-            'behavior': {'close_to_tray': False, 'shell_path': None, 'show_system_info_on_startup': False},
+            'appearance': {'theme': 'dark', 'font_family': 'Consolas', 'font_size': 11, 'show_ansi_colors': True, 'renderer': 'text'},
+            'behavior': {'close_to_tray': False, 'shell_path': None, 'show_system_info_on_startup': False, 'scrollback_lines': 10000, 'backend': 'pipe', 'output_buffer_kb': 8192, 'output_overflow': 'block', 'input_buffer_kb': 16384, 'metrics_file': None, 'metrics_interval': 1.0, 'session_server': False, 'server_pool': 2, 'server_scrollback_kb': 4096},
             'auto_update': False, 'first_run': True
         }
+        self.flat = {}
+        self.saved = None
+        self.save_due = None
+        self.writer = None
+        self.lock = threading.Condition()
+        self.write_lock = threading.Lock()
         self.load_config()
+        atexit.register(self.flush)
 
     def load_config(self):
         self.config_file.parent.mkdir(parents=True, exist_ok=True)
         try:
             if self.config_file.exists():
                 with open(self.config_file, 'r') as f:
-                    self.config = {**self.default_config, **json.load(f)}
+                    self.saved = f.read()
+                    self.config = {**copy.deepcopy(self.default_config), **json.loads(self.saved)}
             else:
-                self.config = self.default_config
-            self.save_config()
+                self.config = copy.deepcopy(self.default_config)
         except:
-            self.config = self.default_config
+            self.config = copy.deepcopy(self.default_config)
+        self._flatten()
         self.theme_manager = ThemeManager()
         self.theme = self.theme_manager.get_theme(self.get_setting('appearance', 'theme'))
 
     def save_config(self):
-        with open(self.config_file, 'w') as f:
-            json.dump(self.config, f, indent=2)
+        with self.lock:
+            self.save_due = time.monotonic() + self.SAVE_DELAY
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_behind, daemon=True)
+                self.writer.start()
+            self.lock.notify()
+
+    def flush(self):
+        with self.lock: self.save_due = None
+        self._save()
+
+    def _write_behind(self):
+        while True:
+            with self.lock:
+                while self.save_due is None or self.save_due > time.monotonic():
+                    self.lock.wait(None if self.save_due is None else self.save_due - time.monotonic())
+                self.save_due = None
+            try: self._save()
+            except OSError as e: print(f"Failed to save settings: {e}")
+
+    # The exit flush and the write-behind thread take turns, each writing the settings as they are
+    # when its turn comes, so an older snapshot never lands last
+    def _save(self):
+        with self.write_lock:
+            with self.lock: data = json.dumps(self.config, indent=2)
+            self._write(data)
+
+    def _write(self, data):
+        # Skip unchanged content; otherwise replace the file atomically, from a temp file of its own
+        if data == self.saved: return
+        with tempfile.NamedTemporaryFile('w', dir=self.config_file.parent, prefix='settings-', suffix='.tmp', delete=False) as f:
+            f.write(data)
+        try: os.replace(f.name, self.config_file)
+        except OSError:
+            os.unlink(f.name)
+            raise
+        self.saved = data
+
+    def _flatten(self):
+        flat = {}
+        def walk(path, node):
+            flat[path] = node
+            if isinstance(node, dict):
+                for k, v in node.items(): walk(path + (k,), v)
+        walk((), self.default_config)
+        walk((), self.config)
+        self.flat = flat
 
     def get_setting(self, *keys):
-        curr = self.config
-        for k in keys:
-            if isinstance(curr, dict) and k in curr: curr = curr[k]
-            else:
-                curr = self.default_config
-                for dk in keys:
-                    if isinstance(curr, dict) and dk in curr: curr = curr[dk]
-                    else: return None
-                return curr
-        return curr
+        return self.flat.get(keys)
 
     def set_setting(self, val, *keys):
-        curr = self.config
-        for k in keys[:-1]: curr = curr.setdefault(k, {})
-        curr[keys[-1]] = val
+        with self.lock:
+            curr = self.config
+            for k in keys[:-1]: curr = curr.setdefault(k, {})
+            curr[keys[-1]] = val
+        self._flatten()
         self.save_config()
 
     def set_theme(self, name):
@@ -0,0 +1,131 @@
+import os, re, threading
+if os.name == 'nt': import msvcrt
+else: import fcntl
+
+# Command history kept in an append-only file, one command per line, shared by every window.
+# In memory all commands live in one newline-joined string, oldest first, so prefix and
+# substring lookups are str.rfind calls that walk back from the most recent entry.
+class CommandHistory:
+    FUZZY_SLICE = 64 << 10  # fuzzy matching scans back this many characters at a time
+
+    def __init__(self, path):
+        self.path = path
+        self.blob = '\n'
+        self.offset = 0  # bytes of the file already in blob
+        self.loader = threading.Thread(target=self._load, daemon=True)
+        self.loader.start()
+
+    def __len__(self):
+        self.loader.join()
+        return self.blob.count('\n') - 1
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f: data = f.read()
+        except OSError: return
+        end = data.rfind(b'\n') + 1
+        self.offset = end
+        # Only the most recent copy of a repeated command is kept in memory
+        lines = data[:end].decode('utf-8', 'replace').split('\n')[:-1]
+        unique = list(dict.fromkeys(reversed(lines)))
+        unique.reverse()
+        self.blob = '\n' + ''.join(line + '\n' for line in unique)
+
+    def append(self, cmd):
+        if not cmd.strip() or '\n' in cmd: return
+        self.loader.join()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Binary on Windows too, so offsets count the bytes written
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0), 0o600)
+        try:
+            _lock(fd)
+            try:
+                # Take in what other windows appended since we last looked, then add ours after it
+                self._read_new(fd)
+                data = (cmd + '\n').encode('utf-8')
+                os.write(fd, data)
+                self.offset += len(data)
+                self.blob += cmd + '\n'
+            finally: _unlock(fd)
+        finally: os.close(fd)
+
+    # Picks up commands other windows appended; cheap when nothing changed
+    def refresh(self):
+        self.loader.join()
+        try: size = os.path.getsize(self.path)
+        except OSError: return
+        if size == self.offset: return
+        if size < self.offset:  # replaced or truncated
+            self.blob, self.offset = '\n', 0
+        with open(self.path, 'rb') as f: self._read_new(f.fileno())
+
+    def _read_new(self, fd):
+        os.lseek(fd, self.offset, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(fd, 1 << 20)
+            if not chunk: break
+            chunks.append(chunk)
+        data = b''.join(chunks)
+        end = data.rfind(b'\n') + 1
+        if end:
+            self.blob += data[:end].decode('utf-8', 'replace')
+            self.offset += end
+
+    # Commands starting with prefix, most recent first, each once
+    def prefix_matches(self, prefix):
+        self.loader.join()
+        blob, seen = self.blob, set()
+        pos, key = len(blob) - 1, '\n' + prefix
+        while True:
+            i = blob.rfind(key, 0, pos)
+            if i < 0: return
+            cmd = blob[i + 1:blob.index('\n', i + 1)]
+            pos = i
+            if cmd not in seen and cmd != prefix:
+                seen.add(cmd)
+                yield cmd
+
+    # Commands containing query, most recent first; then fuzzy matches that contain its
+    # characters in order, tightest first within each slice of history
+    def search(self, query):
+        self.loader.join()
+        if not query: return
+        blob, seen = self.blob, set()
+        pos = len(blob)
+        while True:
+            i = blob.rfind(query, 0, pos)
+            if i < 0: break
+            start = blob.rfind('\n', 0, i) + 1
+            cmd = blob[start:blob.index('\n', i)]
+            pos = start
+            if cmd not in seen:
+                seen.add(cmd)
+                yield cmd
+        if len(query) < 2: return
+        pattern = re.compile('[^\n]*?'.join(map(re.escape, query)))
+        end = len(blob)
+        while end > 1:
+            start = blob.rfind('\n', 0, max(end - self.FUZZY_SLICE, 1)) + 1
+            found = []
+            for m in pattern.finditer(blob, start, end):
+                line = blob.rfind('\n', 0, m.start()) + 1
+                found.append((m.end() - m.start(), -line, blob[line:blob.index('\n', m.end())]))
+            for _, _, cmd in sorted(found):
+                if cmd not in seen:
+                    seen.add(cmd)
+                    yield cmd
+            end = start - 1
+
+
+def _lock(fd):
+    if os.name == 'nt':
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+    else: fcntl.flock(fd, fcntl.LOCK_EX)
+
+def _unlock(fd):
+    if os.name == 'nt':
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else: fcntl.flock(fd, fcntl.LOCK_UN)
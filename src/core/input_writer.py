@@ -0,0 +1,99 @@
+import threading, os, select
+from collections import deque
+
+# Feeds the shell's stdin from its own thread, so a large paste or a child that stops reading
+# never blocks the GUI. Input is queued up to `limit` bytes and written in chunks the size of a
+# pipe buffer; `on_progress` is called from the writer thread after each chunk.
+# Given an IOLoop, the loop's thread does the writing when the fd is writable and no thread is started.
+class InputWriter:
+    CHUNK_SIZE = 64 << 10
+    WAIT = 0.2  # seconds between checks for close() while the child is not reading
+
+    def __init__(self, fd, limit=16 << 20, chunk_size=CHUNK_SIZE, on_progress=None, loop=None):
+        self.fd, self.limit, self.chunk_size, self.on_progress = fd, limit, chunk_size, on_progress
+        self.chunks = deque()
+        self.pending = self.total = 0  # total is the size of the current burst, for progress
+        self.generation = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        if os.name != 'nt': os.set_blocking(fd, False)
+        self.loop, self.thread = loop, None
+        self.current = None  # (unwritten part, chunk size, generation) while the loop writes
+        if loop is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    # Queues data unless that would pass the limit; returns whether it was accepted
+    def submit(self, data):
+        with self.cond:
+            if self.closed or self.pending + len(data) > self.limit: return False
+            if not self.pending: self.total = 0
+            for i in range(0, len(data), self.chunk_size):
+                self.chunks.append(data[i:i + self.chunk_size])
+            self.pending += len(data)
+            self.total += len(data)
+            self.cond.notify()
+        if self.loop: self.loop.call(self.loop.add_writer, self.fd, self._writable)
+        return True
+
+    # Drops queued input, including the unwritten part of the current chunk
+    def clear(self):
+        with self.cond:
+            self.chunks.clear()
+            self.pending = self.total = 0
+            self.generation += 1
+        self._progress()
+
+    def progress(self):
+        with self.cond: return self.total - self.pending, self.total
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.loop: self.loop.call(self.loop.remove_writer, self.fd, wait=True)
+        else: self.thread.join(1)
+
+    # Loop mode: writes while the fd takes data; False once there is nothing left to write
+    def _writable(self, fd):
+        while True:
+            if self.current is None:
+                with self.cond:
+                    if self.closed or not self.chunks: return False
+                    chunk = self.chunks.popleft()
+                    self.current = (memoryview(chunk), len(chunk), self.generation)
+            view, size, generation = self.current
+            if generation == self.generation:
+                try: written = os.write(fd, view)
+                except BlockingIOError: return True
+                except OSError:  # the shell went away
+                    self.current = None
+                    return False
+                if written < len(view):
+                    self.current = (view[written:], size, generation)
+                    continue
+            self.current = None
+            with self.cond:
+                if self.generation == generation: self.pending -= size
+            self._progress()
+
+    def _run(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.chunks and not self.closed: self.cond.wait()
+                    if self.closed: return
+                    chunk, generation = self.chunks.popleft(), self.generation
+                view = memoryview(chunk)
+                while view:
+                    try: view = view[os.write(self.fd, view):]
+                    except BlockingIOError:
+                        select.select([], [self.fd], [], self.WAIT)
+                        if self.closed or self.generation != generation: break
+                with self.cond:
+                    if self.generation == generation: self.pending -= len(chunk)
+                self._progress()
+        except OSError: pass  # the shell went away
+
+    def _progress(self):
+        if self.on_progress: self.on_progress()
@@ -0,0 +1,102 @@
+import os, selectors, threading
+from collections import deque
+
+# One selector thread serving the shells of every session: it reads their output and writes their
+# queued input, so a session adds file descriptors rather than threads. Handlers run on the loop
+# thread and must not block; a reader whose consumer has fallen behind is paused instead.
+# Other threads change registrations through call(), which runs a function on the loop thread.
+class IOLoop:
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None: cls._shared = cls()
+            return cls._shared
+
+    def __init__(self):
+        self.sel = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = os.pipe()
+        for fd in (self.wake_r, self.wake_w): os.set_blocking(fd, False)
+        self.sel.register(self.wake_r, selectors.EVENT_READ, None)
+        self.handlers = {}  # fd -> [reader, writer, paused]
+        self.calls = deque()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name='aerominal-io', daemon=True)
+        self.thread.start()
+
+    # Runs fn(*args) on the loop thread; with wait=True, returns once it has run
+    def call(self, fn, *args, wait=False):
+        if threading.current_thread() is self.thread:
+            fn(*args)
+            return
+        done = threading.Event() if wait else None
+        with self.lock: self.calls.append((fn, args, done))
+        try: os.write(self.wake_w, b'\0')
+        except BlockingIOError: pass  # a wakeup is already pending
+        if done: done.wait()
+
+    # The methods below run on the loop thread only.
+    # A reader is called with the fd when it is readable; a writer when it is writable, and is
+    # dropped once it returns False (nothing left to write).
+    def add_reader(self, fd, callback):
+        self._handler(fd)[0] = callback
+        self._update(fd)
+
+    def remove_reader(self, fd):
+        if fd in self.handlers:
+            self.handlers[fd][0] = None
+            self._update(fd)
+
+    def pause_reader(self, fd, paused=True):
+        if fd in self.handlers:
+            self.handlers[fd][2] = paused
+            self._update(fd)
+
+    def add_writer(self, fd, callback):
+        self._handler(fd)[1] = callback
+        self._update(fd)
+
+    def remove_writer(self, fd):
+        if fd in self.handlers:
+            self.handlers[fd][1] = None
+            self._update(fd)
+
+    def _handler(self, fd):
+        return self.handlers.setdefault(fd, [None, None, False])
+
+    def _update(self, fd):
+        reader, writer, paused = self.handlers[fd]
+        events = (selectors.EVENT_READ if reader and not paused else 0) | (selectors.EVENT_WRITE if writer else 0)
+        try: key = self.sel.get_key(fd)
+        except KeyError: key = None
+        if not reader and not writer: del self.handlers[fd]
+        try:
+            if not events:
+                if key: self.sel.unregister(fd)
+            elif key: self.sel.modify(fd, events)
+            else: self.sel.register(fd, events)
+        except (OSError, ValueError): self.handlers.pop(fd, None)  # closed under us
+
+    def _run(self):
+        while True:
+            for key, events in self.sel.select():
+                fd = key.fd
+                if fd == self.wake_r:
+                    try:
+                        while os.read(fd, 4096): pass
+                    except BlockingIOError: pass
+                    continue
+                handler = self.handlers.get(fd)
+                try:
+                    if handler and handler[0] and events & selectors.EVENT_READ: handler[0](fd)
+                    handler = self.handlers.get(fd)
+                    if handler and handler[1] and events & selectors.EVENT_WRITE and not handler[1](fd): self.remove_writer(fd)
+                except Exception as e: print(f"I/O handler failed: {e!r}")
+            while self.calls:
+                with self.lock: fn, args, done = self.calls.popleft()
+                try: fn(*args)
+                except Exception as e: print(f"I/O call failed: {e!r}")
+                finally:
+                    if done: done.set()
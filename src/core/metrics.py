@@ -0,0 +1,120 @@
+import threading, time, json, csv, os, atexit
+from bisect import bisect_left
+
+# Histogram over fixed millisecond buckets; percentiles are read as the bucket's upper bound
+class Histogram:
+    BOUNDS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, float('inf'))
+
+    def __init__(self):
+        self.buckets = [0] * len(self.BOUNDS)
+        self.count, self.total, self.max = 0, 0.0, 0.0
+
+    def add(self, value):
+        self.buckets[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max: self.max = value
+
+    def percentile(self, p):
+        rank, seen = self.count * p / 100, 0
+        for bound, n in zip(self.BOUNDS, self.buckets):
+            seen += n
+            if n and seen >= rank: return min(bound, self.max)
+        return 0.0
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.percentile(50), 'p95': self.percentile(95), 'p99': self.percentile(99), 'max': self.max}
+
+
+# Counters, gauges and timing histograms for one shell and its window. Call sites test
+# `enabled` before taking any timestamps, so a disabled instance costs one attribute check.
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.dumper = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.counters, self.gauges, self.histograms = {}, {}, {}
+
+    def count(self, name, n=1):
+        with self.lock: self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+            peak = name + '_peak'
+            if value > self.gauges.get(peak, float('-inf')): self.gauges[peak] = value
+
+    def time(self, name, ms):
+        with self.lock:
+            hist = self.histograms.get(name)
+            if hist is None: hist = self.histograms[name] = Histogram()
+            hist.add(ms)
+
+    def snapshot(self):
+        with self.lock:
+            return {'time': time.time(), 'uptime': time.monotonic() - self.started, 'counters': dict(self.counters),
+                    'gauges': dict(self.gauges), 'histograms': {k: h.summary() for k, h in self.histograms.items()}}
+
+    # Flattens a snapshot to {'histograms.frame_ms.p95': ...} for CSV rows
+    @staticmethod
+    def flatten(snapshot):
+        row = {'time': snapshot['time'], 'uptime': snapshot['uptime']}
+        for group in ('counters', 'gauges'):
+            for k, v in snapshot[group].items(): row[f'{group}.{k}'] = v
+        for k, summary in snapshot['histograms'].items():
+            for stat, v in summary.items(): row[f'histograms.{k}.{stat}'] = v
+        return row
+
+    # Appends a snapshot to `path` every `interval` seconds from a background thread until
+    # stop_dump(): CSV rows for *.csv (the header is rewritten as new columns appear), JSON lines otherwise
+    def start_dump(self, path, interval=1.0):
+        self.stop_dump()
+        stop = threading.Event()
+        self.dumper = (stop, threading.Thread(target=self._dump, args=(str(path), interval, stop), daemon=True))
+        self.dumper[1].start()
+        atexit.register(self.stop_dump)
+
+    def stop_dump(self):
+        if self.dumper:
+            stop, thread = self.dumper
+            stop.set()
+            thread.join()
+            self.dumper = None
+            atexit.unregister(self.stop_dump)
+
+    def _dump(self, path, interval, stop):
+        columns = []
+        while True:
+            last = stop.wait(interval)
+            snap = self.snapshot()
+            try:
+                if path.endswith('.csv'): columns = self._write_row(path, self.flatten(snap), columns)
+                else:
+                    with open(path, 'a') as f: f.write(json.dumps(snap) + '\n')
+            except OSError as e:
+                print(f"Failed to write metrics: {e}")
+                return
+            if last: return
+
+    @staticmethod
+    def _write_row(path, row, columns):
+        new = [k for k in row if k not in columns]
+        if not new:
+            with open(path, 'a', newline='') as f: csv.DictWriter(f, columns).writerow(row)
+            return columns
+        # Metrics seen for the first time widen the header; earlier rows are rewritten under it
+        columns = columns + new
+        rows = []
+        if columns != new and os.path.exists(path):
+            with open(path, newline='') as f: rows = list(csv.DictReader(f))
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, columns)
+            writer.writeheader()
+            writer.writerows(rows + [row])
+        return columns
@@ -0,0 +1,116 @@
+import threading, queue
+from collections import deque
+from .ansi_parser import runs_size, tail_runs
+
+# Byte-bounded replacement for the reader -> GUI queue, holding parsed ANSIStream runs.
+# Past `limit` bytes a reader either blocks, which stops it pulling from the child
+# ("block"), or the oldest output is dropped down to the last `keep` lines ("fast_forward").
+# Dropped output is replaced by a marker saying how much was skipped.
+# A reader that must not block (the shared I/O loop) puts with block=False and stops reading
+# when told the buffer is full; `on_space` is called once the consumer has made room again.
+class OutputBuffer:
+    def __init__(self, limit=8 << 20, keep=10000, policy='block'):
+        self.limit, self.keep, self.policy = limit, keep, policy
+        self.chunks = deque()  # (runs, characters, lines)
+        self.size = self.lines = self.peak = 0
+        self.skipped = self.skipped_lines = self.skipped_total = 0
+        self.closed = self.forwarding = self.full = False
+        self.on_space = None
+        self.cond = threading.Condition()
+
+    # Returns False when the buffer is full after a non-blocking put
+    def put(self, runs, block=True):
+        size, lines = runs_size(runs)
+        with self.cond:
+            while self.size >= self.limit and not self.closed:
+                if self.policy == 'fast_forward':
+                    self._drop_to(self.keep)
+                    break
+                if not block: break
+                self.cond.wait()
+            self.chunks.append((runs, size, lines))
+            self.size += size
+            self.lines += lines
+            if self.forwarding: self._drop_to(self.keep)
+            self.peak = max(self.peak, self.size)
+            if self.size >= self.limit and self.policy != 'fast_forward' and not block: self.full = True
+            return not self.full
+
+    # Returns (runs, characters, lines)
+    def get_nowait(self):
+        with self.cond:
+            if self.skipped:
+                marker = f"\n[aerominal: skipped {self.skipped_lines:,} lines ({self.skipped / 1024:,.0f} KiB) of output]\n"
+                self.skipped = self.skipped_lines = 0
+                return [(marker, 0)], len(marker), 2
+            if not self.chunks:
+                self.forwarding = False
+                raise queue.Empty
+            item = self.chunks.popleft()
+            self.size -= item[1]
+            self.lines -= item[2]
+            if self.size < self.limit: self.cond.notify_all()
+            space = self._made_space()
+        if space: space()
+        return item
+
+    def _made_space(self):
+        if self.full and self.size < self.limit:
+            self.full = False
+            return self.on_space
+
+    # Puts back the part of a chunk the consumer had no time for this frame
+    def unget(self, runs):
+        if not runs: return
+        size, lines = runs_size(runs)
+        with self.cond:
+            self.chunks.appendleft((runs, size, lines))
+            self.size += size
+            self.lines += lines
+
+    def empty(self): return not self.chunks and not self.skipped
+
+    def qsize(self): return len(self.chunks)
+
+    # Skips everything but the last `keep` lines, e.g. after an interrupt. Output still in
+    # flight is collapsed the same way until the consumer has caught up.
+    def fast_forward(self):
+        with self.cond:
+            self.forwarding = True
+            self._drop_to(self.keep)
+            self.cond.notify_all()
+            space = self._made_space()
+        if space: space()
+
+    def _drop_to(self, keep):
+        chunks = self.chunks
+        while chunks and self.lines - chunks[0][2] >= keep:
+            _, size, lines = chunks.popleft()
+            self._skip(size, lines)
+        if chunks and self.lines > keep:
+            # Cut the oldest remaining chunk at a line boundary
+            runs, size, lines = chunks.popleft()
+            kept = keep - (self.lines - lines)
+            rest = tail_runs(runs, kept)
+            rest_size = runs_size(rest)[0]
+            self._skip(size - rest_size, lines - kept)
+            chunks.appendleft((rest, rest_size, kept))
+
+    def _skip(self, size, lines):
+        self.size -= size
+        self.lines -= lines
+        self.skipped += size
+        self.skipped_lines += lines
+        self.skipped_total += size
+
+    # Releases blocked readers; used while the shell is being stopped
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def reopen(self):
+        with self.cond: self.closed = self.full = False
+
+    def stats(self):
+        return {'bytes': self.size, 'lines': self.lines, 'chunks': len(self.chunks), 'peak_bytes': self.peak, 'skipped_bytes': self.skipped_total}
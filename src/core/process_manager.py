@@ -1,45 +1,405 @@
+import subprocess, threading, os, sys, signal, codecs, locale, struct, shlex, time
+from urllib.parse import urlsplit, unquote
+if os.name != 'nt': import fcntl, pty, termios
+from .output_buffer import OutputBuffer
+from .ansi_parser import ANSIStream
+from .input_writer import InputWriter
+from .recorder import read_recording
+from .metrics import Metrics
+from .io_loop import IOLoop
+
+# Shells report their working directory with OSC 7 (file://host/path), which the ANSI parser
+# turns into a 'cwd' op; output is never searched for it.
+OSC7_HOOK = r'printf "\033]7;file://%s%s\033\\" "$HOSTNAME" "$PWD"'
+CMD_PROMPT = '$E]7;$P$E\\'
+
+class StreamDecoder:
+    def __init__(self, encoding):
+        self.decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self.carry = ''
+
+    def decode(self, data, final=False):
+        text, self.carry = self.carry + self.decoder.decode(data, final), ''
+        # Hold back a split \r\n until the rest arrives; lone \r is left to the renderer
+        if not final and text.endswith('\r'): text, self.carry = text[:-1], '\r'
+        return text.replace('\r\n', '\n')
 
-import subprocess, threading, queue, os, signal
 
 class ProcessManager:
-    def __init__(self, config):
+    CHUNK_SIZE = 64 << 10
+
+    def __init__(self, config, loop=None):
         self.config = config
-        self.output_queue = queue.Queue()
+        # Shells share one I/O thread where their pipes can be polled; Windows gets a thread per pipe
+        self.loop = loop or (IOLoop.shared() if os.name != 'nt' else None)
+        self.fds = {}  # fd -> StreamDecoder, for the fds the loop reads
+        # A fast-forward keeps half a scrollback of tail, so the skip marker is still reachable above it
+        self.output_queue = OutputBuffer(int(config.get_setting('behavior', 'output_buffer_kb')) << 10,
+                                         keep=int(config.get_setting('behavior', 'scrollback_lines')) // 2,
+                                         policy=config.get_setting('behavior', 'output_overflow'))
+        self.on_output = None  # called from the reader thread when new output is waiting
+        self.sink = None  # when set, takes the raw output text in place of the parser and queue (session server)
+        self.on_exit = None  # called on the loop thread once the shell has closed all its output
+        self.ansi = ANSIStream()
+        self.palette = None  # StylePalette of the current theme, warmed with each new style
+        self.parse_lock = threading.Lock()
+        self.recorder = None  # SessionRecorder taking everything read and written
+        self.metrics = Metrics()
+        self.on_input_progress = None  # called from the writer thread as queued input drains
+        self.input_limit = int(config.get_setting('behavior', 'input_buffer_kb')) << 10
+        self.writer = None
+        self.notified = False
         self.process = None
+        self.readers = []
+        self.output_queue.on_space = self._resume_reading
         self.cwd = os.getcwd()
+        self.cwd_link = None  # /proc/<shell>/cwd where the kernel can be asked directly
+        self.encoding = locale.getpreferredencoding(False)
+        self.size = (80, 24)
+
+    def shell(self):
+        return self.config.get_setting('behavior', 'shell_path') or ('cmd.exe' if os.name == 'nt' else 'bash')
 
     def start(self):
-        cmd = self.config.get_setting('behavior', 'shell_path') or ('cmd.exe' if os.name == 'nt' else 'bash')
+        self.output_queue.reopen()
+        self.ansi.reset()
+        cmd = self.shell()
         args = [cmd, '/v:on', '/k'] if os.name == 'nt' and cmd == 'cmd.exe' else [cmd]
-        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1, universal_newlines=True, creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
-        threading.Thread(target=self._read, args=(self.process.stdout,), daemon=True).start()
-        threading.Thread(target=self._read, args=(self.process.stderr,), daemon=True).start()
+        env = dict(os.environ, PROMPT=CMD_PROMPT) if os.name == 'nt' else None  # cmd echoes its prompt before each command
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+        self.cwd_link = f'/proc/{self.process.pid}/cwd' if sys.platform.startswith('linux') else None
+        self._start_writer(self.process.stdin.fileno())
+        pipes = [self.process.stdout, self.process.stderr]
+        if os.name == 'nt':
+            # Anonymous pipes can't be polled on Windows, so each one gets a blocking reader
+            for pipe in pipes: self._spawn_reader(self._read_pipe, pipe)
+        else:
+            self._start_reader([p.fileno() for p in pipes])
+
+    # Startup spawns the shell before the window exists; the window then only starts one that isn't running
+    def started(self):
+        return self.process is not None
+
+    def _start_writer(self, fd, chunk_size=InputWriter.CHUNK_SIZE):
+        self.writer = InputWriter(fd, self.input_limit, chunk_size, lambda: self.on_input_progress and self.on_input_progress(), self.loop)
 
-    def _read(self, pipe):
+    def _spawn_reader(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.readers.append(thread)
+
+    def _start_reader(self, fds):
+        for fd in fds:
+            os.set_blocking(fd, False)
+            self.fds[fd] = StreamDecoder(self.encoding)
+            self.loop.call(self.loop.add_reader, fd, self._readable)
+
+    # On the loop thread: one read per wakeup keeps sessions taking turns. A full output queue
+    # pauses this shell's fds until the GUI has drained it, which is when the child blocks.
+    def _readable(self, fd):
+        try: data = os.read(fd, self.CHUNK_SIZE)
+        except BlockingIOError: return
+        except OSError: data = b''
+        if self.metrics.enabled: self._count_read(data)
+        decoder = self.fds.get(fd)
+        if decoder is None: return
+        if not data:
+            self.loop.remove_reader(fd)
+            del self.fds[fd]
+        room = self._emit(decoder.decode(data, not data), block=False)
+        if not data and not self.fds and self.on_exit: self.on_exit()
+        if not room: self._pause_all(True)
+
+    def _resume_reading(self):
+        if self.loop: self.loop.call(self._pause_all, False)
+
+    def _pause_all(self, paused):
+        for fd in self.fds: self.loop.pause_reader(fd, paused)
+
+    def _detach(self):
+        for fd in self.fds: self.loop.remove_reader(fd)
+        self.fds = {}
+
+    def _read_pipe(self, pipe):
+        decoder = StreamDecoder(self.encoding)
         try:
-            for line in iter(pipe.readline, ''):
-                if line:
-                    if "__CWD__:" in line:
-                        self.cwd = line.split("__CWD__:", 1)[1].strip()
-                        self.output_queue.put(line)
-                    else:
-                        self.output_queue.put(line)
+            while True:
+                data = os.read(pipe.fileno(), self.CHUNK_SIZE)
+                if self.metrics.enabled: self._count_read(data)
+                self._emit(decoder.decode(data, not data))
+                if not data: break
         except: pass
 
+    def _count_read(self, data):
+        self.metrics.count('reads')
+        self.metrics.count('bytes_in', len(data))
+
+    # Escapes are parsed and styles resolved here on the reader thread, so the GUI only inserts runs.
+    # The lock keeps the stream order when Windows runs one reader per pipe.
+    # Returns False if a non-blocking put found the output queue full.
+    def _emit(self, text, block=True):
+        if not text: return True
+        if self.sink: return self.sink(text)
+        room = True
+        with self.parse_lock:
+            if self.recorder: self.recorder.record('o', text)
+            timed = self.metrics.enabled
+            if timed: start = time.perf_counter()
+            runs = self.ansi.feed(text)
+            if not runs: return True
+            palette = self.palette
+            if palette:
+                for val, style in runs:
+                    if val is not None: palette.resolve(style)
+            if timed:
+                self.metrics.time('parse_ms', (time.perf_counter() - start) * 1000)
+                start = time.perf_counter()
+            room = self.output_queue.put(runs, block)
+            # Time a reader spent blocked on a full queue
+            if timed: self.metrics.time('queue_wait_ms', (time.perf_counter() - start) * 1000)
+        # One wakeup per drain: the consumer clears `notified` before it starts reading the queue
+        if not self.notified and self.on_output:
+            self.notified = True
+            self.on_output()
+        return room
+
+    # Queues command lines for the shell; False if the input queue is full and nothing was sent
     def write(self, cmd):
-        if self.process:
-            if os.name == 'nt':
-                full_cmd = f"{cmd} & echo. & echo __CWD__:!CD!\n"
-            else:
-                full_cmd = f"{cmd}; echo __CWD__:$PWD\n"
-            self.process.stdin.write(full_cmd)
-            self.process.stdin.flush()
+        return self.write_many([cmd])
+
+    def write_many(self, cmds):
+        if not self.process or not cmds: return False
+        text = '\n'.join(cmds)
+        # A shell on a pipe has no prompt hook, so without /proc it reports through a printf builtin
+        if os.name != 'nt' and not self.cwd_link: text = f"{text}; {OSC7_HOOK}"
+        return self._submit(f"{text}\n")
+
+    def _submit(self, text):
+        if not self.writer.submit(text.encode(self.encoding, 'replace')): return False
+        if self.recorder: self.recorder.record('i', text)
+        return True
+
+    # (bytes written, bytes in the current burst); equal once all queued input is through
+    def input_progress(self):
+        return self.writer.progress() if self.writer else (0, 0)
+
+    # Takes the payload of an OSC 7 report
+    def report_cwd(self, url):
+        parts = urlsplit(url)
+        self.cwd = unquote(parts.path) if parts.scheme == 'file' else url
+
+    # Re-reads the shell's cwd where it is polled; True if it changed
+    def poll_cwd(self):
+        if not self.cwd_link or not self.process: return False
+        try: cwd = os.readlink(self.cwd_link)
+        except OSError: return False
+        changed, self.cwd = cwd != self.cwd, cwd
+        return changed
+
+    def busy(self):
+        return bool(self.process and self._children(self.process.pid))
 
     def interrupt(self):
+        # Signal whatever the shell is running, leaving the shell and its state alone
+        if not self.process: return
+        self.writer.clear()
+        self.output_queue.fast_forward()
+        if os.name == 'nt':
+            children = self._children(self.process.pid)
+            # Without a process list there is nothing to single out, so the shell goes with its job
+            if children is None: return self.restart()
+            for pid in children:
+                subprocess.call(['taskkill', '/F', '/T', '/PID', str(pid)], creationflags=subprocess.CREATE_NO_WINDOW)
+        else:
+            self._signal_descendants(self.process.pid, signal.SIGINT)
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    # Lets go of the shell when the window closes; only shells kept by a session server outlive it
+    def detach(self):
+        self.stop()
+
+    # None on Windows if the process list can't be read
+    def _children(self, pid):
+        if os.name == 'nt': return windows_children(pid)
+        try:
+            children = []
+            for tid in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{tid}/children') as f: children += map(int, f.read().split())
+            return children
+        except OSError:
+            out = subprocess.run(['pgrep', '-P', str(pid)], capture_output=True, text=True).stdout
+            return [int(p) for p in out.split()]
+
+    def _signal_descendants(self, pid, sig):
+        stack = self._children(pid)
+        while stack:
+            child = stack.pop()
+            stack += self._children(child)
+            try: os.kill(child, sig)
+            except ProcessLookupError: pass
+
+    def resize(self, cols, rows):
+        self.size = (cols, rows)
+        if self.recorder: self.recorder.record('r', f"{cols}x{rows}")
+
+    def _terminate(self, proc):
+        if os.name == 'nt':
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(proc.pid)], creationflags=subprocess.CREATE_NO_WINDOW)
+        else:
+            self._signal_descendants(proc.pid, signal.SIGTERM)
+            proc.terminate()
+
+    def stop(self):
+        proc, self.process = self.process, None
+        if not proc: return
+        self._terminate(proc)
+        try: proc.wait(1)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        self.output_queue.close()
+        # Detached before the fds are closed, so a stray child still holding the output open doesn't matter
+        if self.loop: self.loop.call(self._detach, wait=True)
+        for thread in self.readers: thread.join(1)
+        self.readers = []
+        for f in (proc.stdin, proc.stdout, proc.stderr):
+            try:
+                if f: f.close()
+            except OSError: pass
+
+
+class PtyProcessManager(ProcessManager):
+    def __init__(self, config, loop=None):
+        super().__init__(config, loop)
+        self.master = None
+
+    def start(self):
+        self.output_queue.reopen()
+        self.ansi.reset()
+        cmd = self.shell()
+        args = [cmd, '--noediting', '-i'] if os.path.basename(cmd).startswith('bash') else [cmd, '-i']
+        master, slave = pty.openpty()
+        attrs = termios.tcgetattr(slave)
+        attrs[3] &= ~termios.ECHO  # the input line is echoed by the UI, not the terminal
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+        self.master = master
+        self.resize(*self.size)
+        env = dict(os.environ, TERM='xterm-256color', PS1='', PS2='')
+        self.process = subprocess.Popen(args, stdin=slave, stdout=slave, stderr=slave, env=env, start_new_session=True,
+                                        preexec_fn=lambda: fcntl.ioctl(0, termios.TIOCSCTTY, 0))
+        os.close(slave)
+        # The terminal's input queue is 4 KiB, so larger writes would only wait on it
+        self._start_writer(master, 4096)
+        # Set after the rc files ran; each prompt then reports the cwd
+        self.writer.submit(f" PS1= PS2= PROMPT_COMMAND={shlex.quote(OSC7_HOOK)}\n".encode())
+        self._start_reader([master])
+
+    def write_many(self, cmds):
+        if not self.process or not cmds: return False
+        return self._submit('\n'.join(cmds) + '\n')
+
+    def interrupt(self):
+        # ^C through the line discipline signals the foreground job only; queued input is dropped first
         if self.process:
-            if os.name == 'nt': subprocess.call(['taskkill', '/F', '/T', '/PID', str(self.process.pid)])
-            else: self.process.send_signal(signal.SIGINT)
-            self.start()
+            self.writer.clear()
+            self.output_queue.fast_forward()
+            self._submit('\x03')
+
+    def resize(self, cols, rows):
+        super().resize(cols, rows)
+        if self.master is not None:
+            fcntl.ioctl(self.master, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+
+    def _terminate(self, proc):
+        # Interactive shells ignore SIGTERM; hangup also reaches their background jobs
+        self._signal_descendants(proc.pid, signal.SIGHUP)
+        proc.send_signal(signal.SIGHUP)
 
     def stop(self):
-        if self.process: self.process.terminate()
+        super().stop()
+        if self.master is not None:
+            os.close(self.master)
+            self.master = None
+
+
+# Plays a recording back through the same parse -> output queue -> frame path as a live shell.
+# `speed` scales the recorded timing; 0 replays as fast as the renderer takes the output.
+class ReplayProcessManager(ProcessManager):
+    def __init__(self, config, path, speed=1.0):
+        super().__init__(config)
+        self.path, self.speed = path, speed
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.output_queue.reopen()
+        self.ansi.reset()
+        self.stopping.clear()
+        self._spawn_reader(self._replay)
+
+    def _replay(self):
+        try: _, events = read_recording(self.path)
+        except (OSError, ValueError) as e:
+            self._emit(f"[aerominal: cannot replay {self.path}: {e}]\n")
+            return
+        start = time.monotonic()
+        try:
+            for t, kind, data in events:
+                if kind != 'o': continue
+                if self.speed:
+                    wait = t / self.speed - (time.monotonic() - start)
+                    if wait > 0 and self.stopping.wait(wait): return
+                if self.stopping.is_set(): return
+                self._emit(data)
+        except (OSError, ValueError, EOFError) as e:
+            self._emit(f"\n[aerominal: recording is damaged: {e}]\n")
+        self._emit(f"\n[aerominal: replay finished in {time.monotonic() - start:.2f}s]\n")
+
+    def started(self): return bool(self.readers)
+
+    # Input has nowhere to go; it is taken and dropped
+    def write_many(self, cmds): return True
+
+    def interrupt(self): self.output_queue.fast_forward()
+
+    def stop(self):
+        self.stopping.set()
+        self.output_queue.close()
+        for thread in self.readers: thread.join(1)
+        self.readers = []
+
+
+# Child processes from a Toolhelp snapshot, which every Windows has (wmic is gone from recent ones);
+# the console host cmd.exe is attached to is not a job
+def windows_children(pid):
+    import ctypes, ctypes.wintypes
+    class Entry(ctypes.Structure):
+        _fields_ = [('dwSize', ctypes.wintypes.DWORD), ('cntUsage', ctypes.wintypes.DWORD), ('th32ProcessID', ctypes.wintypes.DWORD),
+                    ('th32DefaultHeapID', ctypes.c_size_t), ('th32ModuleID', ctypes.wintypes.DWORD), ('cntThreads', ctypes.wintypes.DWORD),
+                    ('th32ParentProcessID', ctypes.wintypes.DWORD), ('pcPriClassBase', ctypes.c_long), ('dwFlags', ctypes.wintypes.DWORD),
+                    ('szExeFile', ctypes.c_wchar * 260)]
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.CreateToolhelp32Snapshot.restype = ctypes.wintypes.HANDLE
+    kernel32.Process32FirstW.argtypes = kernel32.Process32NextW.argtypes = [ctypes.wintypes.HANDLE, ctypes.POINTER(Entry)]
+    kernel32.CloseHandle.argtypes = [ctypes.wintypes.HANDLE]
+    snapshot = kernel32.CreateToolhelp32Snapshot(0x2, 0)  # TH32CS_SNAPPROCESS
+    if snapshot in (None, ctypes.wintypes.HANDLE(-1).value): return None
+    try:
+        entry, children = Entry(dwSize=ctypes.sizeof(Entry)), []
+        more = kernel32.Process32FirstW(snapshot, ctypes.byref(entry))
+        while more:
+            if entry.th32ParentProcessID == pid and entry.szExeFile.lower() != 'conhost.exe': children.append(entry.th32ProcessID)
+            more = kernel32.Process32NextW(snapshot, ctypes.byref(entry))
+        return children
+    finally: kernel32.CloseHandle(snapshot)
+
+
+def create_process_manager(config, loop=None):
+    if config.get_setting('behavior', 'backend') == 'pty' and os.name != 'nt':
+        return PtyProcessManager(config, loop)
+    return ProcessManager(config, loop)
@@ -0,0 +1,69 @@
+import gzip, json, threading, time, atexit
+
+# Records a session as an asciicast v2 file: a JSON header line, then one [seconds, kind, data]
+# line per event, 'o' for output read from the shell, 'i' for input sent to it and 'r' for a
+# resize ("COLSxROWS"). record() only appends to a list; a writer thread encodes and compresses
+# the events in batches. Paths ending in .gz are gzipped.
+class SessionRecorder:
+    FLUSH_INTERVAL = 0.5  # seconds between writes
+    MAX_BATCH = 4096  # events that wake the writer early
+
+    def __init__(self, path, size=(80, 24)):
+        self.path = path
+        self.start = time.monotonic()
+        self.events = []
+        self.closed = False
+        self.cond = threading.Condition()
+        # Level 1 costs a fraction of the default and terminal output still shrinks several times
+        self.file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=1) if str(path).endswith('.gz') else open(path, 'w', encoding='utf-8')
+        self.file.write(json.dumps({'version': 2, 'width': size[0], 'height': size[1], 'timestamp': int(time.time())}) + '\n')
+        self.thread = threading.Thread(target=self._write_behind, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def record(self, kind, data):
+        with self.cond:
+            if self.closed: return
+            self.events.append((time.monotonic() - self.start, kind, data))
+            if len(self.events) >= self.MAX_BATCH: self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            if self.closed: return
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        atexit.unregister(self.close)
+
+    def _write_behind(self):
+        try:
+            while True:
+                with self.cond:
+                    if not self.closed and len(self.events) < self.MAX_BATCH: self.cond.wait(self.FLUSH_INTERVAL)
+                    events, self.events, closed = self.events, [], self.closed
+                if events:
+                    dumps = json.dumps
+                    self.file.write(''.join(f'[{t:.6f}, "{kind}", {dumps(data, ensure_ascii=False)}]\n' for t, kind, data in events))
+                if closed: break
+        except OSError as e:
+            print(f"Failed to write recording: {e}")
+            with self.cond: self.closed, self.events = True, []
+        finally:
+            try: self.file.close()
+            except OSError: pass
+
+
+# Reads a recording made by SessionRecorder (or any asciicast v2 file, gzipped or not).
+# Returns the header and an iterator over (seconds, kind, data) events.
+def read_recording(path):
+    with open(path, 'rb') as f: gzipped = f.read(2) == b'\x1f\x8b'
+    f = gzip.open(path, 'rt', encoding='utf-8') if gzipped else open(path, encoding='utf-8')
+    try: header = json.loads(f.readline())
+    except ValueError:
+        f.close()
+        raise
+    def events():
+        with f:
+            for line in f:
+                if line.strip(): yield tuple(json.loads(line))
+    return header, events()
@@ -0,0 +1,165 @@
+from array import array
+from itertools import groupby
+
+# Rows store codepoints and packed ANSIStream styles in flat arrays, so history costs
+# 12 bytes per cell and no Python object per character.
+class Row:
+    __slots__ = ('chars', 'attrs', 'wrapped', 'runs')
+
+    def __init__(self, text='', style=0):
+        self.chars = array('I')
+        self.attrs = array('Q')
+        self.wrapped = False
+        self.runs = None
+        if text: self.append(text, style)
+
+    def __len__(self): return len(self.chars)
+
+    def text(self): return self.chars.tobytes().decode('utf-32-le')
+
+    def append(self, text, style):
+        self.chars.frombytes(text.encode('utf-32-le'))
+        self.attrs.extend(array('Q', [style]) * len(text))
+        self.runs = None
+
+    def put(self, col, text, style):
+        n = len(self.chars)
+        if col > n:
+            self.append(' ' * (col - n), 0)
+            n = col
+        if col == n:
+            self.append(text, style)
+            return
+        end = col + len(text)
+        self.chars[col:end] = array('I', text.encode('utf-32-le'))
+        self.attrs[col:end] = array('Q', [style]) * len(text)
+        self.runs = None
+
+    # Blanks cells [start, end); without an end the row is cut at start
+    def erase(self, start, end=None):
+        if end is None or end >= len(self.chars):
+            del self.chars[start:]
+            del self.attrs[start:]
+            self.runs = None
+        elif end > start:
+            self.put(start, ' ' * (end - start), 0)
+
+    # [(column, text, style), ...], cached until the row changes
+    def get_runs(self):
+        if self.runs is None:
+            text, col, runs = self.text(), 0, []
+            for style, cells in groupby(self.attrs):
+                n = len(list(cells))
+                runs.append((col, text[col:col + n], style))
+                col += n
+            self.runs = runs
+        return self.runs
+
+
+# History plus a cursor. The last `height` rows are the addressable screen, so cursor
+# movement and erases rewrite rows in place instead of appending new ones.
+class Screen:
+    __slots__ = ('rows', 'cols', 'height', 'cx', 'cy')
+
+    def __init__(self, cols=80, height=24):
+        self.rows = [Row()]
+        self.cols, self.height = cols, height
+        self.cx = self.cy = 0
+
+    def __len__(self): return len(self.rows)
+
+    def top(self): return max(len(self.rows) - self.height, 0)
+
+    def line_feed(self):
+        self.cy += 1
+        self.cx = 0
+        if self.cy == len(self.rows): self.rows.append(Row())
+
+    def write(self, text, style=0):
+        rows = self.rows
+        for i, seg in enumerate(text.split('\n')):
+            if i: self.line_feed()
+            while seg:
+                room = self.cols - self.cx
+                if room <= 0:
+                    rows[self.cy].wrapped = True
+                    self.line_feed()
+                    continue
+                rows[self.cy].put(self.cx, seg[:room], style)
+                self.cx += min(room, len(seg))
+                seg = seg[room:]
+
+    def control(self, op, args):
+        n = args[0] if args and args[0] else 1
+        mode = args[0] if args else 0
+        if op == '\r': self.cx = 0
+        elif op == '\x08': self.cx = max(self.cx - 1, 0)
+        elif op == 'K':
+            row = self.rows[self.cy]
+            if mode == 0: row.erase(self.cx)
+            elif mode == 1: row.erase(0, self.cx + 1)
+            else: row.erase(0)
+        elif op in 'AF': self.cy = max(self.cy - n, self.top())
+        elif op in 'BE': self.cy = min(self.cy + n, len(self.rows) - 1)
+        elif op == 'C': self.cx = min(self.cx + n, self.cols - 1)
+        elif op == 'D': self.cx = max(self.cx - n, 0)
+        elif op == 'G': self.cx = min(n - 1, self.cols - 1)
+        elif op in 'Hf':
+            self.cy = self.top() + n - 1
+            while self.cy >= len(self.rows): self.rows.append(Row())
+            self.cx = min((args[1] if len(args) > 1 and args[1] else 1) - 1, self.cols - 1)
+        elif op == 'J':
+            if mode == 0:
+                self.rows[self.cy].erase(self.cx)
+                del self.rows[self.cy + 1:]
+            elif mode == 1:
+                for row in self.rows[self.top():self.cy]: row.erase(0)
+                self.rows[self.cy].erase(0, self.cx + 1)
+            elif mode == 2:
+                # Scroll the screen into history and continue on a blank one
+                rel = self.cy - self.top()
+                self.rows.extend(Row() for _ in range(self.height))
+                self.cy = self.top() + rel
+            else: self.clear()
+        if op in 'EF': self.cx = 0
+
+    # text() as a callable that may run on another thread. Rows above the screen no longer
+    # change, so only the screen's rows are copied now.
+    def snapshot(self):
+        top = self.top()
+        rows, tail = self.rows[:top], self.text(top)
+        return lambda: ''.join(r.text() + ('' if r.wrapped else '\n') for r in rows) + tail
+
+    # Row where each logical line starts; wrapped rows continue the line above them
+    def line_starts(self):
+        return [0] + [i + 1 for i, row in enumerate(self.rows[:-1]) if not row.wrapped]
+
+    # (row, column) of a column in a logical line, following the line across wrapped rows
+    def locate(self, starts, line, col):
+        row = starts[line]
+        while col >= len(self.rows[row]) and self.rows[row].wrapped and row + 1 < len(self.rows):
+            col -= len(self.rows[row])
+            row += 1
+        return row, col
+
+    def text(self, start=0, end=None):
+        return ''.join(r.text() + ('' if r.wrapped else '\n') for r in self.rows[start:end])
+
+    # Drops the oldest n rows and returns them as plain text
+    def evict(self, n):
+        text = self.text(0, n)
+        del self.rows[:n]
+        if not self.rows: self.rows.append(Row())
+        self.cy = max(self.cy - n, 0)
+        return text
+
+    def prepend_text(self, text):
+        page = Screen(self.cols)
+        page.write(text[:-1] if text.endswith('\n') else text)
+        self.rows[:0] = page.rows
+        self.cy += len(page.rows)
+        return len(page.rows)
+
+    def clear(self):
+        self.rows = [Row()]
+        self.cx = self.cy = 0
@@ -0,0 +1,66 @@
+import mmap, tempfile, threading, zlib
+
+# Compressed on-disk stack of lines evicted from the live terminal view.
+# read() may be called from a search thread, so file access is serialized.
+class ScrollbackSpill:
+    def __init__(self, directory):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.file = tempfile.TemporaryFile(dir=directory, prefix='scrollback-')
+        self.chunks = []  # (offset, length, line count), oldest first
+        self.size = 0
+        self.map = None
+        self.written = False  # the file changed since it was mapped
+        self.lock = threading.Lock()
+
+    def __len__(self): return len(self.chunks)
+
+    @property
+    def lines(self): return sum(c[2] for c in self.chunks)
+
+    def push(self, text):
+        data = zlib.compress(text.encode('utf-8', 'replace'), 1)
+        with self.lock:
+            self.file.seek(self.size)
+            self.file.write(data)
+            self.file.flush()
+            self.written = True
+            self.chunks.append((self.size, len(data), text.count('\n')))
+            self.size += len(data)
+
+    def pop(self):
+        with self.lock:
+            offset, length, _ = self.chunks.pop()
+            data = self._bytes(offset, length)
+            self.size = offset
+        return zlib.decompress(data).decode('utf-8', 'replace')
+
+    # The chunk list as it is now; entries stay readable until they are popped and overwritten
+    def snapshot(self): return list(self.chunks)
+
+    def read(self, chunk):
+        with self.lock: data = self._bytes(chunk[0], chunk[1])
+        return zlib.decompress(data).decode('utf-8', 'replace')
+
+    # A push after a pop rewrites bytes that may already be mapped, so any write means a fresh map
+    def _bytes(self, offset, length):
+        if self.map is None or self.written or len(self.map) < offset + length:
+            self._unmap()
+            self.written = False
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def clear(self):
+        with self.lock:
+            self._unmap()
+            self.file.truncate(0)
+            self.chunks, self.size = [], 0
+
+    def close(self):
+        with self.lock:
+            self._unmap()
+            self.file.close()
+
+    def _unmap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
@@ -0,0 +1,64 @@
+import re, threading, zlib
+
+# Searches terminal output on a worker thread: first a snapshot of the live view, then the
+# spilled history from newest to oldest. Lines are numbered from the oldest spilled line, so a
+# match keeps its number while output is appended or evicted to the spill.
+# Each batch handed to `on_batch` is (first line, last line, [(line, column, length), ...]).
+# `live_text` is the view's text, or a callable returning it on the worker thread.
+class ScrollbackSearch:
+    MAX_MATCHES = 100000
+
+    def __init__(self, pattern, live_text, spill, on_batch, on_done=None):
+        self.pattern, self.on_batch, self.on_done = pattern, on_batch, on_done
+        self.live_text = live_text
+        self.spill = spill
+        self.chunks = spill.snapshot() if spill is not None else []
+        self.base = sum(c[2] for c in self.chunks)  # first line of the live view
+        self.count = 0
+        self.cancelled = self.done = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Compiles a query: /.../ is a regular expression, anything else is literal text.
+    # Matching ignores case unless the query has capitals. Raises re.error for a bad regex.
+    @staticmethod
+    def compile(query):
+        flags = 0 if any(c.isupper() for c in query) else re.IGNORECASE
+        if len(query) > 2 and query.startswith('/') and query.endswith('/'):
+            return re.compile(query[1:-1], flags | re.MULTILINE)
+        return re.compile(re.escape(query), flags)
+
+    def cancel(self): self.cancelled = True
+
+    @property
+    def capped(self): return self.count >= self.MAX_MATCHES
+
+    def _run(self):
+        self._scan(self.live_text() if callable(self.live_text) else self.live_text, self.base)
+        self.live_text = None
+        starts, line = [], 0
+        for chunk in self.chunks:
+            starts.append(line)
+            line += chunk[2]
+        for chunk, start in zip(reversed(self.chunks), reversed(starts)):
+            if self.cancelled or self.capped: break
+            try: text = self.spill.read(chunk)
+            except (OSError, ValueError, zlib.error): continue  # paged back in and overwritten meanwhile
+            self._scan(text, start)
+        self.done = True
+        if not self.cancelled and self.on_done: self.on_done(self)
+
+    def _scan(self, text, first):
+        matches, line, pos = [], first, 0
+        for m in self.pattern.finditer(text):
+            if self.cancelled: return
+            start, end = m.span()
+            if start == end: continue
+            line += text.count('\n', pos, start)
+            pos = start
+            col = start - text.rfind('\n', 0, start) - 1
+            matches.append((line, col, end - start))
+            if self.count + len(matches) >= self.MAX_MATCHES: break
+        if matches and not self.cancelled:
+            self.count += len(matches)
+            self.on_batch(self, (first, first + text.count('\n'), matches))
@@ -0,0 +1,417 @@
+import os, socket, struct, json, threading, itertools, signal, subprocess, time
+from collections import deque
+from pathlib import Path
+from .io_loop import IOLoop
+from .process_manager import ProcessManager, create_process_manager
+
+# Background process that owns the shells, so they and their output outlive the windows showing
+# them. Windows attach over a Unix socket; a new session is handed a shell from a pool that was
+# spawned in advance, and a reattaching window gets the retained output back in one frame.
+# Everything on the server side runs on its IOLoop thread, sockets and shells alike.
+
+# A frame is a type byte and a payload length, then the payload
+HEADER = struct.Struct('!BI')
+# Window -> server
+ATTACH = 1  # JSON {"session": id or null, "size": [cols, rows]}
+INPUT = 2  # command lines, UTF-8
+RESIZE = 3  # !HH cols, rows
+INTERRUPT = 4
+RESTART = 5
+DETACH = 6  # leave the shell running
+KILL = 7  # end the shell
+LIST = 8
+# Server -> window
+ATTACHED = 9  # JSON {"session": id, "pid": shell pid}
+OUTPUT = 10  # shell output, UTF-8
+REPLAY = 11  # retained output, sent once after ATTACHED
+EXITED = 12  # the shell ended
+SESSIONS = 13  # JSON [{"session": id, "attached": bool, "cwd": path}]
+
+def frame(kind, payload=b''):
+    return HEADER.pack(kind, len(payload)) + payload
+
+def socket_path(config):
+    return config.config_dir / 'run' / 'server.sock'
+
+
+# Splits a byte stream into (kind, payload) frames
+class FrameReader:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf += data
+        frames, pos = [], 0
+        while len(self.buf) - pos >= HEADER.size:
+            kind, n = HEADER.unpack_from(self.buf, pos)
+            if len(self.buf) - pos - HEADER.size < n: break
+            frames.append((kind, bytes(self.buf[pos + HEADER.size:pos + HEADER.size + n])))
+            pos += HEADER.size + n
+        del self.buf[:pos]
+        return frames
+
+
+# One shell kept by the server, with the tail of its output for windows that attach later
+class Session:
+    def __init__(self, sid, pm, retain):
+        self.id, self.pm, self.retain = sid, pm, retain
+        self.scrollback = deque()
+        self.size = 0
+        self.clients = set()
+
+    def keep(self, data):
+        self.scrollback.append(data)
+        self.size += len(data)
+        while self.size > self.retain and len(self.scrollback) > 1: self.size -= len(self.scrollback.popleft())
+
+
+# A window's connection, as seen by the server
+class Client:
+    def __init__(self, sock):
+        self.sock, self.reader, self.out = sock, FrameReader(), bytearray()
+        self.session = None
+
+
+class SessionServer:
+    BACKLOG = 4 << 20  # bytes queued for a slow window before its shell is paused
+
+    def __init__(self, config, path=None, loop=None):
+        self.config = config
+        self.loop = loop or IOLoop.shared()
+        self.path = Path(path or socket_path(config))
+        self.pool_size = int(config.get_setting('behavior', 'server_pool'))
+        self.retain = int(config.get_setting('behavior', 'server_scrollback_kb')) << 10
+        self.sessions = {}  # id -> Session, for shells that have been attached at least once
+        self.pool = deque()  # warm Sessions nobody has attached yet
+        self.clients = {}  # fd -> Client
+        self.ids = itertools.count(1)
+        self.spawning = threading.Lock()
+        self.listener = None
+        self.done = threading.Event()
+
+    # Runs until SIGTERM/SIGINT; returns the exit status
+    def serve(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        os.chmod(self.path.parent, 0o700)
+        if self.path.exists():
+            if server_alive(self.path):
+                print(f"A session server is already listening on {self.path}")
+                return 1
+            self.path.unlink()  # left behind by a server that died
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(str(self.path))
+        self.listener.listen(16)
+        self.listener.setblocking(False)
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP): signal.signal(sig, lambda *_: self.done.set())
+        self.loop.call(self.loop.add_reader, self.listener.fileno(), self._accept)
+        self._fill_pool()
+        while not self.done.wait(1): pass
+        self.shutdown()
+        return 0
+
+    def shutdown(self):
+        self.loop.call(self._close_all, wait=True)
+        for session in list(self.sessions.values()) + list(self.pool): session.pm.stop()
+        self.sessions.clear()
+        self.pool.clear()
+        try: self.path.unlink()
+        except OSError: pass
+
+    def _close_all(self):
+        if self.listener:
+            self.loop.remove_reader(self.listener.fileno())
+            self.listener.close()
+            self.listener = None
+        for client in list(self.clients.values()): self._drop(client)
+
+    # Shells are spawned off the loop thread so serving never waits on a fork
+    def _fill_pool(self):
+        threading.Thread(target=self._spawn, daemon=True).start()
+
+    def _spawn(self):
+        with self.spawning:
+            while len(self.pool) < self.pool_size and not self.done.is_set():
+                session = self._new_session()
+                self.loop.call(self.pool.append, session, wait=True)
+
+    def _new_session(self):
+        pm = create_process_manager(self.config, self.loop)
+        session = Session(next(self.ids), pm, self.retain)
+        pm.sink = lambda text: self._output(session, text)
+        pm.on_exit = lambda: self._exited(session)
+        pm.start()
+        return session
+
+    # Off the loop thread. The old shell closing its output is not the session ending.
+    def _restart(self, session):
+        session.pm.on_exit = None
+        session.pm.restart()
+        session.pm.on_exit = lambda: self._exited(session)
+
+    def _stop(self, session):
+        session.pm.on_exit = None
+        threading.Thread(target=session.pm.stop, daemon=True).start()
+
+    # The methods below run on the loop thread
+    def _output(self, session, text):
+        data = text.encode('utf-8')
+        session.keep(data)
+        out = frame(OUTPUT, data)
+        for client in session.clients: self._send(client, out)
+        # A window that can't keep up holds its shell back, the way a full output queue does locally
+        return all(len(c.out) < self.BACKLOG for c in session.clients)
+
+    def _exited(self, session):
+        self.sessions.pop(session.id, None)
+        if session in self.pool:
+            self.pool.remove(session)
+            self._fill_pool()
+        for client in list(session.clients): self._send(client, frame(EXITED))
+        self._stop(session)
+
+    def _accept(self, fd):
+        try: sock, _ = self.listener.accept()
+        except (BlockingIOError, OSError): return
+        sock.setblocking(False)
+        self.clients[sock.fileno()] = Client(sock)
+        self.loop.add_reader(sock.fileno(), self._readable)
+
+    def _readable(self, fd):
+        client = self.clients.get(fd)
+        if client is None: return
+        try: data = client.sock.recv(1 << 16)
+        except BlockingIOError: return
+        except OSError: data = b''
+        if not data:
+            self._drop(client)  # a window that went away without detaching leaves its session running
+            return
+        for kind, payload in client.reader.feed(data): self._handle(client, kind, payload)
+
+    def _handle(self, client, kind, payload):
+        session = client.session
+        if kind == ATTACH: self._attach(client, json.loads(payload))
+        elif kind == LIST:
+            listing = [{'session': s.id, 'attached': bool(s.clients), 'cwd': self._cwd(s)} for s in self.sessions.values()]
+            self._send(client, frame(SESSIONS, json.dumps(listing).encode()))
+        elif session is None: return
+        elif kind == INPUT: session.pm.write_many(payload.decode('utf-8', 'replace').split('\n'))
+        elif kind == RESIZE: session.pm.resize(*struct.unpack('!HH', payload))
+        elif kind == INTERRUPT: session.pm.interrupt()
+        elif kind == RESTART:
+            session.scrollback.clear()
+            session.size = 0
+            threading.Thread(target=self._restart, args=(session,), daemon=True).start()
+        elif kind in (DETACH, KILL):
+            if kind == KILL:
+                self.sessions.pop(session.id, None)
+                for other in session.clients - {client}: self._send(other, frame(EXITED))
+                self._stop(session)
+            self._drop(client)
+
+    # Attaches to session `id` if it is still running, else to a warm shell from the pool
+    def _attach(self, client, request):
+        session = self.sessions.get(request.get('session'))
+        if session is None:
+            session = self.pool.popleft() if self.pool else self._new_session()
+            self.sessions[session.id] = session
+            self._fill_pool()
+        client.session = session
+        session.clients.add(client)
+        if request.get('size'): session.pm.resize(*request['size'])
+        pid = session.pm.process.pid if session.pm.process else None
+        self._send(client, frame(ATTACHED, json.dumps({'session': session.id, 'pid': pid}).encode()))
+        self._send(client, frame(REPLAY, b''.join(session.scrollback)))
+
+    def _cwd(self, session):
+        session.pm.poll_cwd()
+        return session.pm.cwd
+
+    def _send(self, client, data):
+        idle = not client.out
+        client.out += data
+        if idle: self.loop.add_writer(client.sock.fileno(), self._writable)
+
+    def _writable(self, fd):
+        client = self.clients.get(fd)
+        if client is None: return False
+        blocked = len(client.out) >= self.BACKLOG
+        try: sent = client.sock.send(client.out)
+        except BlockingIOError: return True
+        except OSError:
+            client.out.clear()
+            return False
+        del client.out[:sent]
+        if blocked and len(client.out) < self.BACKLOG and client.session: client.session.pm._pause_all(False)
+        return bool(client.out)
+
+    def _drop(self, client):
+        fd = client.sock.fileno()
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+        self.clients.pop(fd, None)
+        if client.session:
+            client.session.clients.discard(client)
+            # Output it was holding back for this window can flow again
+            if client.out and client.session.pm.fds: client.session.pm._pause_all(False)
+        client.sock.close()
+
+
+def server_alive(path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(path))
+        return True
+    except OSError: return False
+
+# Starts `command` (a detached server) unless one is listening already, and waits for its socket
+def ensure_server(config, command, timeout=5.0):
+    path = socket_path(config)
+    if server_alive(path): return path
+    subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    while not server_alive(path):
+        if time.monotonic() > deadline: raise OSError(f"session server did not start on {path}")
+        time.sleep(0.01)
+    return path
+
+def list_sessions(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(path))
+        sock.sendall(frame(LIST))
+        reader = FrameReader()
+        while True:
+            data = sock.recv(1 << 16)
+            if not data: return []
+            for kind, payload in reader.feed(data):
+                if kind == SESSIONS: return json.loads(payload)
+
+
+# A session served by the SessionServer: output arrives over the socket and goes through the same
+# parse -> output queue -> frame path as a local shell's; input, resizes and signals go back as frames.
+class RemoteProcessManager(ProcessManager):
+    def __init__(self, config, path, session=None, loop=None):
+        super().__init__(config, loop)
+        self.path, self.session = Path(path), session
+        self.sock = None
+        self.pid = None
+        self.reader = FrameReader()
+        self.outbox = bytearray()
+        self.out_lock = threading.Lock()
+
+    def start(self):
+        self.output_queue.reopen()
+        self.ansi.reset()
+        self.reader = FrameReader()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(str(self.path))
+        self.sock.setblocking(False)
+        self._send(ATTACH, json.dumps({'session': self.session, 'size': list(self.size)}).encode())
+        fd = self.sock.fileno()
+        self.fds[fd] = None
+        self.loop.call(self.loop.add_reader, fd, self._receive)
+
+    def started(self):
+        return self.sock is not None
+
+    def _receive(self, fd):
+        try: data = self.sock.recv(self.CHUNK_SIZE)
+        except BlockingIOError: return
+        except OSError: data = b''
+        if self.metrics.enabled: self._count_read(data)
+        if not data:
+            self._disconnect()
+            self._emit("\n[aerominal: lost the session server]\n")
+            return
+        room = True
+        for kind, payload in self.reader.feed(data):
+            if kind in (OUTPUT, REPLAY): room = self._emit(payload.decode('utf-8', 'replace'), block=False) and room
+            elif kind == ATTACHED:
+                info = json.loads(payload)
+                self.session, self.pid = info['session'], info['pid']
+                link = f'/proc/{self.pid}/cwd'
+                self.cwd_link = link if self.pid and os.path.exists(link) else None
+            elif kind == EXITED:
+                self._disconnect()
+                self._emit("\n[aerominal: shell exited]\n")
+                return
+        if not room: self._pause_all(True)
+
+    def _send(self, kind, payload=b''):
+        if not self.sock: return False
+        with self.out_lock:
+            if len(self.outbox) + len(payload) > self.input_limit: return False
+            self.outbox += frame(kind, payload)
+        self.loop.call(self.loop.add_writer, self.sock.fileno(), self._flush)
+        return True
+
+    def _flush(self, fd):
+        with self.out_lock:
+            try: sent = self.sock.send(self.outbox)
+            except BlockingIOError: return True
+            except OSError:
+                self.outbox.clear()
+                return False
+            del self.outbox[:sent]
+            return bool(self.outbox)
+
+    # On the loop thread
+    def _disconnect(self):
+        if not self.sock: return
+        fd = self.sock.fileno()
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+        self.fds = {}
+        self.sock.close()
+        self.sock = None
+
+    def write_many(self, cmds):
+        if not cmds: return False
+        text = '\n'.join(cmds)
+        if not self._send(INPUT, text.encode('utf-8')): return False
+        if self.recorder: self.recorder.record('i', text + '\n')
+        return True
+
+    def resize(self, cols, rows):
+        super().resize(cols, rows)
+        self._send(RESIZE, struct.pack('!HH', cols, rows))
+
+    def interrupt(self):
+        self.output_queue.fast_forward()
+        self._send(INTERRUPT)
+
+    def restart(self):
+        self._send(RESTART)
+
+    def poll_cwd(self):
+        if not self.cwd_link: return False
+        try: cwd = os.readlink(self.cwd_link)
+        except OSError: return False
+        changed, self.cwd = cwd != self.cwd, cwd
+        return changed
+
+    def busy(self):
+        return bool(self.pid and self._children(self.pid))
+
+    # Ends the shell on the server
+    def stop(self):
+        self._close(KILL)
+
+    # Leaves the shell running on the server, for the next window to attach to
+    def detach(self):
+        self._close(DETACH)
+
+    def _close(self, kind):
+        if self.sock:
+            # The last frame is written out before the socket goes
+            self._send(kind)
+            self.loop.call(self._flush_and_disconnect, wait=True)
+        self.output_queue.close()
+
+    def _flush_and_disconnect(self):
+        if self.sock:
+            self.sock.settimeout(1)
+            try:
+                with self.out_lock: self.sock.sendall(self.outbox)
+            except OSError: pass
+            self.outbox.clear()
+        self._disconnect()
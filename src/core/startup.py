@@ -0,0 +1,51 @@
+import os, time
+
+# Seconds since the process was created, where the kernel says, so the interpreter's own start
+# shows up in the profile; None elsewhere
+def process_age():
+    try:
+        with open('/proc/self/stat') as f: started = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f: uptime = float(f.read().split()[0])
+        return max(uptime - started / os.sysconf('SC_CLK_TCK'), 0.0)
+    except (OSError, ValueError, IndexError, AttributeError): return None
+
+
+# Phase timings for --profile-startup: each mark() closes the phase that ran since the previous one,
+# while note() records a moment, like the shell's first output, without closing a phase. A moment
+# noted after the report is printed when it happens.
+# Marks are cheap enough to leave in place when profiling is off.
+class StartupProfile:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.last = time.perf_counter()
+        age = process_age()
+        self.origin = self.last - (age or 0.0)
+        self.phases = []  # (name, ms, ms since the process started)
+        self.moments = {}  # name -> ms since the process started
+        self.reported = False
+        if age is not None: self.phases.append(('interpreter', age * 1000, age * 1000))
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, (now - self.last) * 1000, (now - self.origin) * 1000))
+        self.last = now
+
+    def note(self, name):
+        if name in self.moments: return
+        at = self.moments[name] = (time.perf_counter() - self.origin) * 1000
+        if self.reported: print(f"{name} after {at:.1f} ms", flush=True)
+
+    def total(self, name):
+        return next((at for phase, _, at in self.phases if phase == name), None)
+
+    def report(self):
+        if not self.enabled: return
+        width = max(len(name) for name, _, _ in self.phases)
+        print(f"{'startup phase':<{width}}  {'ms':>8}  {'at ms':>8}")
+        for name, ms, at in self.phases: print(f"{name:<{width}}  {ms:8.1f}  {at:8.1f}")
+        painted, prompt = self.total('first paint'), self.moments.get('first prompt')
+        if painted is not None: print(f"first paint after {painted:.1f} ms")
+        # A shell that draws no prompt of its own says nothing until its first command
+        if prompt is not None: print(f"first prompt after {prompt:.1f} ms")
+        else: print("first prompt: no output from the shell yet")
+        self.reported = True
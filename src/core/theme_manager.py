@@ -32,22 +32,77 @@ class ThemeManager:
             'nge_unit01': {'background': '#2D003D', 'text_color': '#00FF00', 'input_bg': '#1A0024', 'prompt_color': '#FFD700', 'selection_bg': '#5A007A', 'status_color': '#CCCCCC', 'accent_color': '#00FF00', 'titlebar_bg': '#100015'},
             'nge_retro_computer': {'background': '#1A1A1A', 'text_color': '#FFA500', 'input_bg': '#2A2A2A', 'prompt_color': '#00FF00', 'selection_bg': '#CC8400', 'status_color': '#90EE90', 'accent_color': '#00FF00', 'titlebar_bg': '#000000'}
         }
+        self.themes = dict(self.defaults)  # official themes by name
+        self.user_themes = {}  # name -> (mtime, theme)
+        self.user_dir_mtime = None
+        self.loaded = False
+
+    # Writes out the official theme files and reads both theme directories. get_theme() does without
+    # it, so startup can leave this until the window is up.
+    def load(self):
+        if self.loaded: return
+        self.loaded = True
         self._init_defaults()
+        self._scan_user_dir()
 
     def _init_defaults(self):
+        # Only rewrite official files that are missing or differ; pick up any extra official themes once
         for name, data in self.defaults.items():
-            with open(self.official_dir / f"{name}.json", 'w') as f: json.dump(data, f, indent=4)
+            path = self.official_dir / f"{name}.json"
+            content = json.dumps(data, indent=4)
+            try:
+                if path.stat().st_size == len(content) and path.read_text() == content: continue
+            except OSError: pass
+            with open(path, 'w', newline='\n') as f: f.write(content)
+        for f in self.official_dir.glob('*.json'):
+            if f.stem in self.defaults: continue
+            try:
+                with open(f, 'r') as tf: self.themes[f.stem] = json.load(tf)
+            except: pass
+
+    def _scan_user_dir(self):
+        try: mtime = self.user_dir.stat().st_mtime_ns
+        except OSError: return
+        if mtime == self.user_dir_mtime: return
+        self.user_dir_mtime = mtime
+        paths = {f.stem: f for f in self.user_dir.glob('*.json')}
+        for name in self.user_themes.keys() - paths.keys(): del self.user_themes[name]
+        for name, path in paths.items(): self._load_user_theme(name, path)
+
+    def _load_user_theme(self, name, path):
+        try: mtime = path.stat().st_mtime_ns
+        except OSError:
+            self.user_themes.pop(name, None)
+            return
+        cached = self.user_themes.get(name)
+        if cached and cached[0] == mtime: return
+        try:
+            with open(path, 'r') as tf: self.user_themes[name] = (mtime, json.load(tf))
+        except: pass
 
     def get_theme(self, name):
-        themes = {}
-        for d in [self.official_dir, self.user_dir]:
-            for f in d.glob('*.json'):
-                try:
-                    with open(f, 'r') as tf: themes[f.stem] = json.load(tf)
-                except: pass
-        return themes.get(name, themes.get('dark', self.defaults['dark']))
+        if not self.loaded: return self._peek(name)
+        self._scan_user_dir()
+        for key in (name, 'dark'):
+            if key in self.user_themes: self._load_user_theme(key, self.user_dir / f"{key}.json")
+            if key in self.user_themes: return self.user_themes[key][1]
+            if key in self.themes: return self.themes[key]
+        return self.defaults['dark']
+
+    # One theme read straight from its file, with the same precedence as the loaded registry
+    def _peek(self, name):
+        for key in (name, 'dark'):
+            try:
+                with open(self.user_dir / f"{key}.json", 'r') as tf: return json.load(tf)
+            except (OSError, ValueError): pass
+            if key in self.defaults: return self.defaults[key]
+            try:
+                with open(self.official_dir / f"{key}.json", 'r') as tf: return json.load(tf)
+            except (OSError, ValueError): pass
+        return self.defaults['dark']
 
     def get_available_themes(self):
-        themes = set(self.defaults.keys())
-        for d in [self.official_dir, self.user_dir]: themes.update(f.stem for f in d.glob('*.json'))
-        return sorted(list(themes))
+        self.load()
+        self._scan_user_dir()
+        for name in list(self.user_themes): self._load_user_theme(name, self.user_dir / f"{name}.json")
+        return sorted(self.themes.keys() | self.user_themes.keys())
@@ -1,16 +1,60 @@
-
-import sys, os
+import sys, os, argparse
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from PyQt6.QtWidgets import QApplication
-from src.core.config_manager import ConfigManager
-from src.core.process_manager import ProcessManager
-from src.ui.app import AerominalApp
+from src.core.startup import StartupProfile
+
+# How to start this program again as a detached session server
+def server_command():
+    if getattr(sys, 'frozen', False): return [sys.executable, '--server']
+    return [sys.executable, os.path.abspath(sys.argv[0]), '--server']
 
+# The shell is spawned before Qt is imported, so its startup overlaps building the window.
+# Everything the first paint doesn't need is left to AerominalApp.finish_startup().
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(prog='aerominal')
+    parser.add_argument('--record', metavar='FILE', help='record the session as asciicast (gzipped if FILE ends in .gz)')
+    parser.add_argument('--replay', metavar='FILE', help='play back a recording instead of starting a shell')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor; 0 plays as fast as it renders')
+    parser.add_argument('--metrics', metavar='FILE', help='dump performance metrics to FILE periodically (CSV if it ends in .csv, else JSON lines)')
+    parser.add_argument('--server', action='store_true', help='run the session server in the foreground')
+    parser.add_argument('--attach', action='store_true', help='keep shells in the session server (started if needed) and reattach to its detached sessions')
+    parser.add_argument('--profile-startup', action='store_true', help='print how long each startup phase took once the window is up')
+    args, qt_args = parser.parse_known_args()
+    profile = StartupProfile(args.profile_startup)
+
+    from src.core.config_manager import ConfigManager
+    from src.core.process_manager import create_process_manager, ReplayProcessManager
     cfg = ConfigManager()
-    pm = ProcessManager(cfg)
-    window = AerominalApp(cfg, pm)
+    profile.mark('config')
+    if args.server:
+        from src.core.session_server import SessionServer
+        sys.exit(SessionServer(cfg).serve())
+
+    factory, detached = create_process_manager, []
+    if (args.attach or cfg.get_setting('behavior', 'session_server')) and os.name != 'nt' and not args.replay:
+        from src.core.session_server import RemoteProcessManager, ensure_server, list_sessions
+        try:
+            path = ensure_server(cfg, server_command())
+            detached = [s['session'] for s in list_sessions(path) if not s['attached']]
+            factory = lambda config: RemoteProcessManager(config, path)
+        except OSError as e: print(f"Session server unavailable, starting a local shell: {e}")
+    if args.replay: pm = ReplayProcessManager(cfg, args.replay, args.speed)
+    elif detached: pm = RemoteProcessManager(cfg, path, detached[0])
+    else: pm = factory(cfg)
+    if args.record:
+        from src.core.recorder import SessionRecorder
+        pm.recorder = SessionRecorder(args.record, pm.size)
+    pm.start()
+    profile.mark('shell spawn')
+
+    from PyQt6.QtWidgets import QApplication
+    from src.ui.app import AerominalApp
+    profile.mark('imports: qt and ui')
+    app = QApplication(sys.argv[:1] + qt_args)
+    profile.mark('qapplication')
+    window = AerominalApp(cfg, pm, factory, profile)
+    for session in detached[1:]: window.new_tab(RemoteProcessManager(cfg, path, session))
+    if args.metrics: window.start_metrics_dump(args.metrics)
+    profile.mark('window')
     window.run()
     sys.exit(app.exec())
 
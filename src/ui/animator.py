@@ -2,33 +2,42 @@ from PyQt6.QtCore import QVariantAnimation, QPropertyAnimation, QEasingCurve, Qt
 from PyQt6.QtGui import QColor
 
 class ThemeAnimator:
+    KEYS = ('background', 'text_color', 'input_bg', 'prompt_color', 'selection_bg')
+    FPS = 60
+
     def __init__(self, app):
         self.app = app
         self.duration = 300
+        self.anim = None
+        self.frames, self.frame = [], -1
 
     def animate_theme_change(self, old_theme, new_theme):
+        if self.anim: self.anim.stop()
+        # Every intermediate theme is worked out up front; a tick only looks one up and
+        # recolours palettes, and the full theme is applied once when the transition ends
+        steps = max(self.duration * self.FPS // 1000, 1)
+        ramps = {}
+        for key in self.KEYS:
+            start, end = QColor(old_theme[key]), QColor(new_theme[key])
+            a, b = (start.red(), start.green(), start.blue()), (end.red(), end.green(), end.blue())
+            ramps[key] = ['#%02x%02x%02x' % tuple(int(x + (y - x) * i / steps) for x, y in zip(a, b)) for i in range(steps + 1)]
+        self.frames = [dict(new_theme, **{key: ramps[key][i] for key in self.KEYS}) for i in range(steps + 1)]
+        self.frame = -1
+
         self.anim = QVariantAnimation()
         self.anim.setDuration(self.duration)
         self.anim.setStartValue(0.0)
         self.anim.setEndValue(1.0)
-        
-        def update_colors(value):
-            current_theme = {}
-            for key in ['background', 'text_color', 'input_bg', 'prompt_color', 'selection_bg']:
-                start_color = QColor(old_theme[key])
-                end_color = QColor(new_theme[key])
-                
-                r = start_color.red() + (end_color.red() - start_color.red()) * value
-                g = start_color.green() + (end_color.green() - start_color.green()) * value
-                b = start_color.blue() + (end_color.blue() - start_color.blue()) * value
-                
-                current_theme[key] = QColor(int(r), int(g), int(b)).name()
-            
-            self.app.apply_theme_colors(current_theme)
-
-        self.anim.valueChanged.connect(update_colors)
+        self.anim.valueChanged.connect(self.show_frame)
+        self.anim.finished.connect(lambda: self.app.apply_theme_colors(new_theme))
         self.anim.start()
 
+    def show_frame(self, value):
+        frame = round(value * (len(self.frames) - 1))
+        if frame != self.frame:
+            self.frame = frame
+            self.app.apply_palette(self.frames[frame])
+
     def animate_opacity_change(self, start_opacity, end_opacity):
         self.opacity_anim = QPropertyAnimation(self.app, b"windowOpacity")
         self.opacity_anim.setDuration(self.duration)
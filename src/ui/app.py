@@ -1,100 +1,106 @@
-import os, sys, ctypes, re
-from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                             QTextEdit, QLineEdit, QLabel, QApplication, QGraphicsOpacityEffect)
-from PyQt6.QtCore import Qt, QTimer, pyqtSignal, QObject, QPropertyAnimation, QEasingCurve, QEvent
-from PyQt6.QtGui import QFont, QColor, QTextCharFormat, QTextCursor, QIcon, QAction
+import os, sys, ctypes, time
+from PyQt6.QtWidgets import QMainWindow, QTabWidget, QSplitter, QApplication
+from PyQt6.QtCore import Qt, QEvent, QTimer
+from PyQt6.QtGui import QFont, QColor, QPalette, QIcon, QAction
 
-from ..core.ansi_parser import ANSIParser
+from ..core.ansi_parser import StylePalette
+from ..core.history import CommandHistory
+from ..core.process_manager import create_process_manager
+from ..core.startup import StartupProfile
 from .animator import ThemeAnimator
 from .menu import CustomMenu
+from .scheduler import RenderScheduler
+from .session import TerminalSession
 
+# The window: tabs of split TerminalSessions, plus what they share. Every session is read and
+# written by the one I/O loop thread and drawn by the one RenderScheduler, so a tab costs a shell
+# and its widgets, not threads or timers of its own.
+# Only what the first paint needs is built up front; the rest waits for finish_startup().
 class AerominalApp(QMainWindow):
-    def __init__(self, config, process_mgr):
+    def __init__(self, config, process_mgr, process_factory=create_process_manager, profile=None):
         super().__init__()
         self.config = config
-        self.pm = process_mgr
+        self.process_factory = process_factory  # config -> ProcessManager, for sessions after the first
+        self.profile = profile or StartupProfile()
+        self.ready = False  # set once the deferred startup work has run
+        self.awaiting_prompt = True  # until the shell's first output is on screen
         self.animator = ThemeAnimator(self)
         self.setWindowTitle("aerominal")
-        
-        self.history = []
-        self.history_idx = -1
-        self.temp_input = ""
-        
+
+        self._history = None
+        self.style_palette = StylePalette(self.config.theme)
+        self.scheduler = RenderScheduler(self)
+        self.sessions = []
+        self.session = None  # the one with focus, or last had it
+
         self.setup_ui()
-        self.set_window_icon()
         self.update_title_bar_color()
-        self.pm.start()
-        
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_output)
-        self.timer.start(10)
+        self.new_tab(process_mgr)
+        metrics_file = self.config.get_setting('behavior', 'metrics_file')
+        if metrics_file: self.start_metrics_dump(metrics_file)
+        QApplication.instance().focusChanged.connect(self.track_focus)
 
     def setup_ui(self):
         width = int(self.config.get_setting('window', 'width'))
         height = int(self.config.get_setting('window', 'height'))
         self.resize(width, height)
         self.setWindowOpacity(self.config.get_setting('window', 'opacity'))
-        
-        central_widget = QWidget()
-        self.setCentralWidget(central_widget)
-        self.layout = QVBoxLayout(central_widget)
-        self.layout.setContentsMargins(0, 0, 0, 0)
-        self.layout.setSpacing(0)
-
-        theme = self.config.theme
+
         font_family = self.config.get_setting('appearance', 'font_family')
         font_size = int(self.config.get_setting('appearance', 'font_size'))
         self.app_font = QFont(font_family, font_size)
 
-        self.txt = QTextEdit()
-        self.txt.setReadOnly(True)
-        self.txt.setFont(self.app_font)
-        self.txt.setFrameStyle(0)
-        self.txt.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
-        self.txt.customContextMenuRequested.connect(self.show_context_menu)
-        self.txt.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        
-        self.input_container = QWidget()
-        self.input_layout = QHBoxLayout(self.input_container)
-        self.input_layout.setContentsMargins(10, 5, 10, 5)
-
-        self.prompt = QLabel(self.get_pwd())
-        self.prompt.setFont(self.app_font)
-        
-        self.input = QLineEdit()
-        self.input.setFont(self.app_font)
-        self.input.setFrame(False)
-        self.input.returnPressed.connect(self.send_cmd)
-        
-        self.input_layout.addWidget(self.prompt)
-        self.input_layout.addWidget(self.input)
-
-        self.layout.addWidget(self.txt)
-        self.layout.addWidget(self.input_container)
-
-        self.apply_theme_colors(theme)
-        self.input.setFocus()
-
-        # Scrollbar Fade Setup
-        self.sb = self.txt.verticalScrollBar()
-        self.sb_effect = QGraphicsOpacityEffect(self.sb)
-        self.sb.setGraphicsEffect(self.sb_effect)
-        self.sb_effect.setOpacity(0.0)
-        self.sb_anim = QPropertyAnimation(self.sb_effect, b"opacity")
-        self.sb_anim.setDuration(200)
-        
-        self.setMouseTracking(True)
-        central_widget.setMouseTracking(True)
-        self.txt.setMouseTracking(True)
-        self.txt.viewport().setMouseTracking(True)
-        self.txt.viewport().installEventFilter(self)
-        self.txt.installEventFilter(self)
+        self.tabs = QTabWidget()
+        self.tabs.setDocumentMode(True)
+        self.tabs.setTabBarAutoHide(True)
+        self.tabs.setTabsClosable(True)
+        self.tabs.setMovable(True)
+        self.tabs.tabCloseRequested.connect(self.close_tab)
+        self.tabs.currentChanged.connect(self.focus_tab)
+        self.setCentralWidget(self.tabs)
+        self.apply_palette(self.config.theme)
 
         # Shortcuts
-        self.clear_action = QAction(self)
-        self.clear_action.setShortcut("Ctrl+L")
-        self.clear_action.triggered.connect(self.clear_screen)
-        self.addAction(self.clear_action)
+        for key, slot in (("Ctrl+L", lambda: self.session.clear_screen()),
+                          ("Ctrl+F", lambda: self.session.open_find()),
+                          ("Ctrl+Shift+T", lambda: self.new_tab()),
+                          ("Ctrl+Shift+E", lambda: self.split(Qt.Orientation.Horizontal)),
+                          ("Ctrl+Shift+O", lambda: self.split(Qt.Orientation.Vertical)),
+                          ("Ctrl+Shift+W", lambda: self.close_session(self.session)),
+                          ("Ctrl+PgDown", lambda: self.step_tab(1)),
+                          ("Ctrl+PgUp", lambda: self.step_tab(-1))):
+            action = QAction(self)
+            action.setShortcut(key)
+            action.triggered.connect(slot)
+            self.addAction(action)
+
+    # Loaded by finish_startup(), or by the first command that needs it
+    @property
+    def history(self):
+        if self._history is None: self._history = CommandHistory(self.config.config_dir / 'history')
+        return self._history
+
+    # Work the first paint doesn't depend on, run right after it
+    def finish_startup(self):
+        if self.ready: return
+        profile = self.profile
+        profile.mark('first paint')
+        self.ready = True
+        self.set_window_icon()
+        profile.mark('deferred: icon')
+        self.config.theme_manager.load()
+        profile.mark('deferred: theme registry')
+        for session in self.sessions: session.apply_scroll_bar_style(self.config.theme)
+        profile.mark('deferred: style sheets')
+        self.history
+        profile.mark('deferred: history')
+        self.config.save_config()  # settings gained since the file was written go out from a background thread
+        profile.mark('deferred: settings')
+        profile.report()
+
+    def first_prompt(self):
+        self.awaiting_prompt = False
+        self.profile.note('first prompt')
 
     def set_window_icon(self):
         try:
@@ -111,197 +117,201 @@ class AerominalApp(QMainWindow):
             bg_color = self.config.theme.get('titlebar_bg', self.config.theme['background']).lstrip('#')
             r, g, b = int(bg_color[:2], 16), int(bg_color[2:4], 16), int(bg_color[4:], 16)
             colorref = (b << 16) | (g << 8) | r
-            
+
             hwnd = self.winId().as_shard_ptr().get() if hasattr(self.winId(), 'as_shard_ptr') else int(self.winId())
-            
+
             DWMWA_CAPTION_COLOR = 35
             ctypes.windll.dwmapi.DwmSetWindowAttribute(
-                hwnd, 
-                DWMWA_CAPTION_COLOR, 
-                ctypes.byref(ctypes.c_int(colorref)), 
+                hwnd,
+                DWMWA_CAPTION_COLOR,
+                ctypes.byref(ctypes.c_int(colorref)),
                 4
             )
         except Exception as e:
             print(f"Failed to update title bar: {e}")
 
-    def get_pwd(self):
-        cwd = getattr(self.pm, 'cwd', os.getcwd())
-        if os.name == 'nt':
-            return cwd + ">"
-        return cwd.replace(os.path.expanduser('~'), '~') + " ❯"
+    # The first session runs `process_mgr`; later ones get a shell of their own
+    def create_session(self, process_mgr=None):
+        session = TerminalSession(self, process_mgr or self.process_factory(self.config))
+        self.sessions.append(session)
+        return session
+
+    def new_tab(self, process_mgr=None):
+        session = self.create_session(process_mgr)
+        splitter = QSplitter()
+        splitter.setChildrenCollapsible(False)
+        splitter.addWidget(session)
+        self.tabs.setCurrentIndex(self.tabs.addTab(splitter, ""))
+        self.session = session
+        self.update_tab_title(session)
+        session.setFocus()
+        return session
+
+    # Splits the current session; a split across the existing direction nests a new splitter
+    def split(self, orientation):
+        current = self.session
+        parent = current.parentWidget()
+        session = self.create_session()
+        if parent.count() > 1 and parent.orientation() != orientation:
+            index, sizes = parent.indexOf(current), parent.sizes()
+            nested = QSplitter(orientation)
+            nested.setChildrenCollapsible(False)
+            parent.insertWidget(index, nested)
+            nested.addWidget(current)
+            parent.setSizes(sizes)
+            parent = nested
+        parent.setOrientation(orientation)
+        parent.insertWidget(parent.indexOf(current) + 1, session)
+        parent.setSizes([1] * parent.count())
+        session.setFocus()
+        return session
+
+    def close_session(self, session):
+        session.shutdown()
+        self.sessions.remove(session)
+        parent = session.parentWidget()
+        session.setParent(None)
+        session.deleteLater()
+        # Splitters left empty go too, up to the tab itself
+        while isinstance(parent, QSplitter) and parent.count() == 0:
+            index = self.tabs.indexOf(parent)
+            up = parent.parentWidget()
+            if index >= 0: self.tabs.removeTab(index)
+            parent.setParent(None)
+            parent.deleteLater()
+            if index >= 0: break
+            parent = up
+        if not self.sessions:
+            self.close()
+            return
+        if session is self.session:
+            page = self.tabs.currentWidget()
+            self.session = next((s for s in self.sessions if page.isAncestorOf(s)), self.sessions[-1])
+            self.session.setFocus()
+
+    def close_tab(self, index):
+        page = self.tabs.widget(index)
+        for session in [s for s in self.sessions if page.isAncestorOf(s)]: self.close_session(session)
+
+    def step_tab(self, step):
+        self.tabs.setCurrentIndex((self.tabs.currentIndex() + step) % self.tabs.count())
 
+    def focus_tab(self, index):
+        page = self.tabs.widget(index)
+        session = next((s for s in self.sessions if page is not None and page.isAncestorOf(s)), None)
+        if session is not None:
+            self.session = session
+            session.setFocus()
+
+    def track_focus(self, old, new):
+        while new is not None and not isinstance(new, TerminalSession): new = new.parentWidget()
+        if new is not None and new in self.sessions: self.session = new
+
+    # A tab is named after the working directory of the session that last had focus in it
+    def update_tab_title(self, session):
+        page = session.parentWidget()
+        while page is not None and self.tabs.indexOf(page) < 0: page = page.parentWidget()
+        if page is None: return
+        cwd = getattr(session.pm, 'cwd', os.getcwd())
+        self.tabs.setTabText(self.tabs.indexOf(page), os.path.basename(cwd.rstrip(os.sep)) or cwd)
+
+    # Colours go through widget palettes, which only repaint. A style sheet is needed for the scroll bar
+    # alone, so it is set there rather than on the window, where every change would re-polish every widget.
     def apply_theme_colors(self, theme):
-        bg = theme['background']
-        fg = theme['text_color']
-        input_bg = theme['input_bg']
-        prompt_fg = theme['prompt_color']
-        sel_bg = theme['selection_bg']
-
-        self.setStyleSheet(f"""
-            QMainWindow, QWidget {{
-                background-color: {bg};
-                color: {fg};
-            }}
-            QTextEdit {{
-                background-color: {bg};
-                color: {fg};
-                selection-background-color: {sel_bg};
-            }}
-            QLineEdit {{
-                background-color: {input_bg};
-                color: {fg};
-            }}
-            QLabel {{
-                color: {prompt_fg};
-            }}
-            QScrollBar:vertical {{
-                border: none;
-                background: {bg};
-                width: 10px;
-                margin: 0px 0px 0px 0px;
-            }}
-            QScrollBar::handle:vertical {{
-                background: {sel_bg};
-                min-height: 20px;
-                border-radius: 5px;
-            }}
-            QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical {{
-                border: none;
-                background: none;
-                height: 0px;
-            }}
-            QScrollBar::up-arrow:vertical, QScrollBar::down-arrow:vertical {{
-                border: none;
-                background: none;
-                color: none;
-            }}
-            QScrollBar::add-page:vertical, QScrollBar::sub-page:vertical {{
-                background: none;
-            }}
-        """)
+        timed = [s.pm.metrics for s in self.sessions if s.pm.metrics.enabled]
+        if timed: start = time.perf_counter()
+        for session in self.sessions: session.apply_scroll_bar_style(theme)
+        self.apply_palette(theme)
         self.update_title_bar_color()
+        for metrics in timed:
+            metrics.count('stylesheet_applies')
+            metrics.time('theme_ms', (time.perf_counter() - start) * 1000)
+
+    # Cheap enough to run on every frame of a theme transition
+    def apply_palette(self, theme):
+        timed = [s.pm.metrics for s in self.sessions if s.pm.metrics.enabled]
+        if timed: start = time.perf_counter()
+        bg, fg = QColor(theme['background']), QColor(theme['text_color'])
+        roles = QPalette.ColorRole
+        pal = self.palette()
+        for role, color in ((roles.Window, bg), (roles.Base, bg), (roles.WindowText, fg), (roles.Text, fg),
+                            (roles.Highlight, QColor(theme['selection_bg']))):
+            pal.setColor(role, color)
+        self.setPalette(pal)
+        for session in self.sessions: session.apply_palette(theme)
+        for metrics in timed: metrics.time('palette_ms', (time.perf_counter() - start) * 1000)
 
-    def show_context_menu(self, pos):
+    def show_context_menu(self, session, pos):
         menu = CustomMenu(self, self.config.theme)
-        menu.add_command("Copy", self.txt.copy)
-        menu.add_command("Paste", self.input.paste)
+        menu.add_command("Copy", session.txt.copy)
+        menu.add_command("Paste", session.input.paste)
         menu.add_separator()
-        menu.add_command("Clear", self.clear_screen)
-        
+        menu.add_command("Clear", session.clear_screen)
+        menu.add_command("Interrupt", session.pm.interrupt)
+        menu.add_command("Restart Shell", session.restart_shell)
+        menu.add_command("Stop Recording" if session.pm.recorder else "Start Recording", session.toggle_recording)
+        menu.add_command("Hide Metrics" if session.overlay.isVisible() else "Show Metrics", session.toggle_overlay)
+        menu.add_command("Stop Metrics Dump" if session.pm.metrics.dumper else "Start Metrics Dump", session.toggle_metrics_dump)
+        menu.add_separator()
+        menu.add_command("New Tab", lambda _: self.new_tab())
+        menu.add_command("Split Right", lambda _: self.split(Qt.Orientation.Horizontal))
+        menu.add_command("Split Down", lambda _: self.split(Qt.Orientation.Vertical))
+        menu.add_command("Close", lambda _: self.close_session(session))
+
         tm = CustomMenu(self, self.config.theme)
         for t in self.config.theme_manager.get_available_themes():
             tm.add_command(t, lambda _, name=t: self.change_theme(name))
         menu.add_cascade("Themes", tm)
-        
+
         om = CustomMenu(self, self.config.theme)
         for o in [0.5, 0.6, 0.7, 0.8, 0.9, 1.0]:
             om.add_command(f"{int(o*100)}%", lambda _, val=o: self.change_opacity(val))
         menu.add_cascade("Opacity", om)
-        
+
         menu.add_separator()
         menu.add_command("Exit", QApplication.quit)
-        
-        menu.exec(self.txt.mapToGlobal(pos))
+
+        menu.exec(session.txt.mapToGlobal(pos))
 
     def change_theme(self, name):
         old_theme = self.config.theme
         self.config.set_theme(name)
+        self.style_palette = StylePalette(self.config.theme)
+        for session in self.sessions: session.set_style_palette(self.style_palette)
         new_theme = self.config.theme
         self.animator.animate_theme_change(old_theme, new_theme)
 
     def change_opacity(self, val):
         self.animator.animate_opacity_change(self.windowOpacity(), val)
 
-    def clear_screen(self):
-        self.txt.clear()
-
-    def send_cmd(self):
-        cmd = self.input.text()
-        if cmd in ['clear', 'cls']:
-            self.clear_screen()
-        elif cmd:
-            if not self.history or self.history[-1] != cmd:
-                self.history.append(cmd)
-            self.history_idx = -1
-            self.pm.write(cmd)
-        self.input.clear()
-        self.prompt.setText(self.get_pwd())
-
-    def update_output(self):
-        show_colors = self.config.get_setting('appearance', 'show_ansi_colors')
-        while not self.pm.output_queue.empty():
-            line = self.pm.output_queue.get()
-            if '\f' in line:
-                self.clear_screen()
-                line = line.split('\f')[-1]
-            
-            line = re.sub(r' & echo\.? & echo __CWD__:[^\s\n]*', '', line)
-
-            if "__CWD__:" in line:
-                line = line.split("__CWD__:", 1)[0]
-                self.prompt.setText(self.get_pwd())
-            
-            if not line: continue
-            
-            if show_colors:
-                self.insert_ansi(line)
-            else:
-                self.txt.insertPlainText(ANSIParser.strip(line))
-            
-            self.txt.moveCursor(QTextCursor.MoveOperation.End)
-        
-        # Only show scrollbar after 250 lines
-        if self.txt.document().blockCount() > 250:
-            self.txt.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
-        else:
-            self.txt.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+    def start_metrics_dump(self, path=None):
+        self.session.start_metrics_dump(path)
+
+    # Sessions that buffered while the window was minimized or covered draw once it is exposed again
+    def flush_hidden(self):
+        for session in self.sessions:
+            if session.flush_pending: session.schedule_frame()
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.Type.WindowStateChange: self.flush_hidden()
 
     def eventFilter(self, obj, event):
-        if (obj == self.txt or obj == self.txt.viewport()) and event.type() == QEvent.Type.MouseMove:
-            pos = event.pos()
-            if obj == self.txt.viewport():
-                # Map viewport pos to text edit pos if needed, but width check is enough
-                x = pos.x()
-                distance_from_right = self.txt.viewport().width() - x
-            else:
-                distance_from_right = self.txt.width() - pos.x()
-            
-            if distance_from_right < 60 and self.txt.document().blockCount() > 250:
-                if self.sb_anim.endValue() != 1.0 or self.sb_anim.state() == QPropertyAnimation.State.Stopped:
-                    self.sb_anim.stop()
-                    self.sb_anim.setEndValue(1.0)
-                    self.sb_anim.start()
-                    self.sb.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents, False)
-            else:
-                if self.sb_anim.endValue() != 0.0 or self.sb_anim.state() == QPropertyAnimation.State.Stopped:
-                    self.sb_anim.stop()
-                    self.sb_anim.setEndValue(0.0)
-                    self.sb_anim.start()
-                    self.sb.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents, True)
+        if obj is self.windowHandle() and event.type() == QEvent.Type.Expose: self.flush_hidden()
         return super().eventFilter(obj, event)
 
-    def insert_ansi(self, text):
-        cursor = self.txt.textCursor()
-        cursor.movePosition(QTextCursor.MoveOperation.End)
-        
-        for type, val in ANSIParser.parse(text):
-            if type == 'text':
-                cursor.insertText(val, self.current_format if hasattr(self, 'current_format') else QTextCharFormat())
-            elif type == 'color':
-                self.current_format = QTextCharFormat()
-                self.current_format.setForeground(QColor(self.get_contrast_color(val)))
-            elif type == 'reset':
-                self.current_format = QTextCharFormat()
-                
-        self.txt.setTextCursor(cursor)
-
-    def get_contrast_color(self, color):
-        try:
-            bg = self.config.theme['background'].lstrip('#')
-            bg_lum = int(bg[:2],16)*0.299 + int(bg[2:4],16)*0.587 + int(bg[4:],16)*0.114
-            return 'white' if bg_lum < 40 and color == 'black' else color
-        except: return color
+    # The deferred startup work is queued behind the first paint
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.ready: QTimer.singleShot(0, self.finish_startup)
+
+    # Closing the window ends local shells; a session server keeps its shells for the next window
+    def closeEvent(self, event):
+        for session in list(self.sessions): session.shutdown(detach=True)
+        self.sessions = []
+        super().closeEvent(event)
 
     def run(self):
         self.show()
-
+        self.windowHandle().installEventFilter(self)
+        self.profile.mark('show')
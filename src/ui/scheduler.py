@@ -0,0 +1,31 @@
+import time
+from PyQt6.QtCore import QObject, QTimer
+
+# One frame timer for every session in a window. A session with new output asks for a frame;
+# each frame renders the visible sessions that asked, sharing the frame budget between them.
+# Hidden sessions (background tabs, a minimized window) draw nothing until shown.
+class RenderScheduler(QObject):
+    FRAME_BUDGET = 0.008  # seconds of rendering allowed per frame
+    FRAME_INTERVAL = 10  # ms between frames while output keeps arriving
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.frame)
+        self.waiting = {}  # sessions that asked for a frame, in order
+        self.last_frame = 0.0
+
+    def request(self, session):
+        self.waiting[session] = None
+        if self.timer.isActive(): return
+        since = (time.perf_counter() - self.last_frame) * 1000
+        self.timer.start(max(int(self.FRAME_INTERVAL - since), 0))
+
+    def frame(self):
+        sessions, self.waiting = list(self.waiting), {}
+        self.last_frame = time.perf_counter()
+        shown = [s for s in sessions if s.output_visible()]
+        budget = self.FRAME_BUDGET / max(len(shown), 1)
+        # A hidden session only takes its output off the queue, to be drawn when it is shown again
+        for session in sessions: session.update_output(budget)
@@ -0,0 +1,887 @@
+import os, re, time, queue
+from bisect import bisect_left, bisect_right
+from collections import deque
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QLineEdit, QLabel, QApplication, QGraphicsOpacityEffect
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal, QObject, QPropertyAnimation, QEvent, QPoint
+from PyQt6.QtGui import QFont, QFontMetrics, QColor, QPalette, QTextCharFormat, QTextCursor, QKeySequence
+
+from ..core.ansi_parser import BOLD, DIM, ITALIC, UNDERLINE, STRIKE, runs_size, split_runs
+from ..core.scrollback import ScrollbackSpill
+from ..core.search import ScrollbackSearch
+from ..core.recorder import SessionRecorder
+from .terminal_view import TerminalView
+
+OVERWRITTEN = re.compile(r'[^\n]*\r')  # a line up to its last carriage return
+
+class OutputWaker(QObject):
+    ready = pyqtSignal()
+    input_progress = pyqtSignal()  # queued input was written to the shell
+    search_batch = pyqtSignal(object, object)  # (ScrollbackSearch, batch)
+    search_done = pyqtSignal(object)
+
+
+# One shell and its view: output, find bar and input line. Sessions live in the tabs and splits of
+# an AerominalApp, which owns what they share: config, theme, command history and the render scheduler.
+# The shell may already be running when the session is created.
+class TerminalSession(QWidget):
+    MIN_FRAME_BYTES, MAX_FRAME_BYTES = 4096, 4 << 20
+    CWD_POLL_MIN, CWD_POLL_MAX = 20, 1000  # ms
+    PROGRESS_MIN = 256 << 10  # input bursts smaller than this don't show progress
+    REFRESH_MS = 1000 / 60  # frames that take longer than a display refresh count as dropped
+    OVERLAY_INTERVAL = 500  # ms between metrics overlay updates
+
+    def __init__(self, app, process_mgr):
+        super().__init__()
+        self.app = app
+        self.config = app.config
+        self.scheduler = app.scheduler
+        self.pm = process_mgr
+        self.pm.palette = app.style_palette
+
+        self.history_idx = -1
+        self.recall, self.recalled = None, []  # Up/Down: prefix matches, and those already shown
+        self.search_query = self.search_results = None  # Ctrl+R
+        self.find_search, self.find_segments, self.find_current = None, [], None  # Ctrl+F
+        self.temp_input = ""
+        self.show_colors = self.config.get_setting('appearance', 'show_ansi_colors')
+        self.formats = {}
+        self.frame_bytes = self.MIN_FRAME_BYTES  # grows from each frame's measured throughput
+        self.frame_stats = {'lines': 0, 'bytes': 0, 'ms': 0.0, 'pending': 0, 'pending_bytes': 0}
+        self.scrollback_lines = int(self.config.get_setting('behavior', 'scrollback_lines') or 0)
+        self.spill = ScrollbackSpill(self.config.config_dir / 'scrollback') if self.scrollback_lines else None
+        self.held, self.held_lines = deque(), 0  # output taken from the queue while hidden, (runs, size, lines)
+        self.trim_pending = False
+
+        self.setup_ui()
+
+        # Frames are requested only when the reader signals new output; nothing polls while idle
+        self.flush_pending = False
+        self.waker = OutputWaker()
+        self.waker.ready.connect(self.schedule_frame)
+        self.pm.on_output = self.waker.ready.emit
+        self.waker.input_progress.connect(self.update_prompt)
+        self.pm.on_input_progress = self.waker.input_progress.emit
+        self.waker.search_batch.connect(self.add_find_batch)
+        self.waker.search_done.connect(lambda search: search is self.find_search and self.show_find_status())
+        # Where the shell's cwd is polled, it is re-read after a command until the shell is idle again
+        self.cwd_timer = QTimer(self)
+        self.cwd_timer.setSingleShot(True)
+        self.cwd_timer.timeout.connect(self.check_cwd)
+        self.cwd_delay = 0
+        self.overlay_timer = QTimer(self)
+        self.overlay_timer.timeout.connect(self.update_overlay)
+        self.overlay_last = None
+        if self.pm.started():
+            if not self.pm.output_queue.empty(): self.schedule_frame()  # output from before there was a window
+        else: self.pm.start()
+        self.update_prompt()
+
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
+
+        font = self.app.app_font
+        self.grid = self.config.get_setting('appearance', 'renderer') == 'grid'
+        if self.grid:
+            self.txt = TerminalView(self.style_colors)
+        else:
+            self.txt = QTextEdit()
+            self.txt.setReadOnly(True)
+            # Where shell output goes; the widget's own textCursor() is the user's selection
+            self.term_cursor = QTextCursor(self.txt.document())
+        self.txt.setFont(font)
+        self.txt.setFrameStyle(0)
+        self.txt.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.txt.customContextMenuRequested.connect(lambda pos: self.app.show_context_menu(self, pos))
+        self.txt.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+
+        self.input_container = QWidget()
+        self.input_layout = QHBoxLayout(self.input_container)
+        self.input_layout.setContentsMargins(10, 5, 10, 5)
+
+        self.prompt = QLabel(self.get_pwd())
+        self.prompt.setFont(font)
+
+        self.input = QLineEdit()
+        self.input.setFont(font)
+        self.input.setFrame(False)
+        self.input.returnPressed.connect(self.send_cmd)
+        self.input.textEdited.connect(self.reset_recall)
+
+        self.input_layout.addWidget(self.prompt)
+        self.input_layout.addWidget(self.input)
+
+        self.find_bar = QWidget()
+        find_layout = QHBoxLayout(self.find_bar)
+        find_layout.setContentsMargins(10, 2, 10, 2)
+        self.find_input = QLineEdit()
+        self.find_input.setFont(font)
+        self.find_input.setFrame(False)
+        self.find_input.setPlaceholderText("Find in scrollback (/regex/)")
+        self.find_input.textChanged.connect(self.start_find)
+        self.find_status = QLabel()
+        self.find_status.setFont(font)
+        find_layout.addWidget(self.find_input)
+        find_layout.addWidget(self.find_status)
+        self.find_bar.hide()
+
+        # Metrics overlay, floating over the top right of the output
+        self.overlay = QLabel(self.txt)
+        self.overlay.setFont(QFont(font.family(), max(font.pointSize() - 2, 6)))
+        self.overlay.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.overlay.setStyleSheet("QLabel { background-color: rgba(0, 0, 0, 160); color: #e0e0e0; padding: 4px; }")
+        self.overlay.hide()
+
+        layout.addWidget(self.txt)
+        layout.addWidget(self.find_bar)
+        layout.addWidget(self.input_container)
+
+        # Until the first paint the scroll bar's style sheet waits with the window's other deferred work
+        if self.app.ready: self.apply_scroll_bar_style(self.config.theme)
+        self.apply_palette(self.config.theme)
+        self.setFocusProxy(self.input)
+
+        # Scrollbar Fade Setup
+        self.sb = self.txt.verticalScrollBar()
+        self.sb_effect = QGraphicsOpacityEffect(self.sb)
+        self.sb.setGraphicsEffect(self.sb_effect)
+        self.sb_effect.setOpacity(0.0)
+        self.sb_anim = QPropertyAnimation(self.sb_effect, b"opacity")
+        self.sb_anim.setDuration(200)
+        self.sb.valueChanged.connect(self.page_in_scrollback)
+        self.sb.valueChanged.connect(self.update_marks)
+
+        self.setMouseTracking(True)
+        self.txt.setMouseTracking(True)
+        self.txt.viewport().setMouseTracking(True)
+        self.txt.viewport().installEventFilter(self)
+        self.txt.installEventFilter(self)
+        self.input.installEventFilter(self)
+        self.find_input.installEventFilter(self)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_terminal_size()
+        if self.overlay.isVisible(): self.place_overlay()
+
+    # Output that arrived while the session was in a background tab is drawn once it is shown
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.flush_pending: self.schedule_frame()
+
+    def update_terminal_size(self):
+        fm = QFontMetrics(self.app.app_font)
+        viewport = self.txt.viewport()
+        size = (max(viewport.width() // max(fm.horizontalAdvance('M'), 1), 1), max(viewport.height() // max(fm.lineSpacing(), 1), 1))
+        if size != self.pm.size: self.pm.resize(*size)
+
+    def get_pwd(self):
+        cwd = getattr(self.pm, 'cwd', os.getcwd())
+        if os.name == 'nt':
+            return cwd + ">"
+        return cwd.replace(os.path.expanduser('~'), '~') + " ❯"
+
+    def apply_scroll_bar_style(self, theme):
+        self.txt.verticalScrollBar().setStyleSheet(f"""
+            QScrollBar:vertical {{
+                border: none;
+                background: {theme['background']};
+                width: 10px;
+                margin: 0px 0px 0px 0px;
+            }}
+            QScrollBar::handle:vertical {{
+                background: {theme['selection_bg']};
+                min-height: 20px;
+                border-radius: 5px;
+            }}
+            QScrollBar::add-line:vertical, QScrollBar::sub-line:vertical {{
+                border: none;
+                background: none;
+                height: 0px;
+            }}
+            QScrollBar::up-arrow:vertical, QScrollBar::down-arrow:vertical {{
+                border: none;
+                background: none;
+                color: none;
+            }}
+            QScrollBar::add-page:vertical, QScrollBar::sub-page:vertical {{
+                background: none;
+            }}
+        """)
+
+    # The window palette reaches the output through inheritance; the input line and labels get their own
+    def apply_palette(self, theme):
+        roles = QPalette.ColorRole
+        pal = self.app.palette()
+        pal.setColor(roles.Base, QColor(theme['input_bg']))
+        for widget in (self.input, self.find_input): widget.setPalette(pal)
+        pal.setColor(roles.WindowText, QColor(theme['prompt_color']))
+        for widget in (self.prompt, self.find_status): widget.setPalette(pal)
+        if self.grid: self.txt.set_colors(theme)
+
+    def set_style_palette(self, style_palette):
+        self.formats.clear()
+        self.pm.palette = style_palette
+
+    def restart_shell(self):
+        self.pm.restart()
+        self.update_prompt()
+
+    # Recordings started from the menu go to ~/.aerominal/recordings
+    def toggle_recording(self):
+        if self.pm.recorder:
+            recorder, self.pm.recorder = self.pm.recorder, None
+            recorder.close()
+        else:
+            path = self.config.config_dir / 'recordings' / time.strftime('%Y%m%d-%H%M%S.cast.gz')
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self.pm.recorder = SessionRecorder(path, self.pm.size)
+            except OSError as e: print(f"Failed to start recording: {e}")
+        self.update_prompt()
+
+    # Metrics are only collected while the overlay is up or a dump is running
+    def set_metrics_enabled(self):
+        metrics = self.pm.metrics
+        enabled = self.overlay.isVisible() or metrics.dumper is not None
+        if enabled and not metrics.enabled: metrics.reset()
+        metrics.enabled = enabled
+
+    def toggle_overlay(self):
+        if self.overlay.isVisible():
+            self.overlay.hide()
+            self.overlay_timer.stop()
+        else:
+            self.overlay.show()
+            self.overlay_last = None
+            self.overlay_timer.start(self.OVERLAY_INTERVAL)
+        self.set_metrics_enabled()
+        if self.overlay.isVisible(): self.update_overlay()
+
+    # Dumps go to the behavior.metrics_file setting, else to ~/.aerominal/metrics; *.csv is written as CSV
+    def start_metrics_dump(self, path=None):
+        if path is None:
+            path = self.config.config_dir / 'metrics' / time.strftime('%Y%m%d-%H%M%S.csv')
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self.pm.metrics.start_dump(path, float(self.config.get_setting('behavior', 'metrics_interval')))
+        self.set_metrics_enabled()
+
+    def toggle_metrics_dump(self):
+        if self.pm.metrics.dumper:
+            self.pm.metrics.stop_dump()
+            self.set_metrics_enabled()
+        else:
+            try: self.start_metrics_dump()
+            except OSError as e: print(f"Failed to start metrics dump: {e}")
+
+    def place_overlay(self):
+        self.overlay.adjustSize()
+        viewport = self.txt.viewport()
+        self.overlay.move(viewport.x() + viewport.width() - self.overlay.width() - 6, viewport.y() + 6)
+
+    def update_overlay(self):
+        snap = self.pm.metrics.snapshot()
+        counters, gauges, hists = snap['counters'], snap['gauges'], snap['histograms']
+        last, self.overlay_last = self.overlay_last, snap
+        span = snap['uptime'] - last['uptime'] if last else snap['uptime']
+        def rate(name):
+            return (counters.get(name, 0) - (last['counters'].get(name, 0) if last else 0)) / max(span, 1e-6)
+        def p95(name):
+            return hists[name]['p95'] if name in hists else 0.0
+        self.overlay.setText("\n".join((
+            f"in     {rate('bytes_in') / 1e6:7.2f} MB/s  {rate('reads'):6.0f} reads/s",
+            f"out    {rate('lines_out'):7.0f} lines/s {rate('frames'):6.0f} fps",
+            f"queue  {gauges.get('queue_bytes', 0) >> 10:7} KiB   peak {gauges.get('queue_bytes_peak', 0) >> 10} KiB",
+            f"parse  {p95('parse_ms'):7.2f} ms p95  wait {p95('queue_wait_ms'):.2f} ms",
+            f"insert {p95('insert_ms'):7.2f} ms p95",
+            f"frame  {p95('frame_ms'):7.2f} ms p95  dropped {counters.get('dropped_frames', 0)}",
+            f"theme  {p95('palette_ms'):7.2f} ms p95  style sheet {p95('theme_ms'):.2f} ms x{counters.get('stylesheet_applies', 0)}",
+        )))
+        self.place_overlay()
+
+    # The spill goes first: clearing the view scrolls to the top, which would page it back in
+    def clear_screen(self):
+        if self.spill is not None: self.spill.clear()
+        self.txt.clear()
+        if self.find_bar.isVisible(): self.start_find()
+
+    def open_find(self):
+        self.find_bar.show()
+        self.find_input.setFocus()
+        self.find_input.selectAll()
+
+    def close_find(self):
+        self.cancel_find()
+        self.find_segments, self.find_current = [], None
+        self.find_bar.hide()
+        self.update_marks()
+        self.input.setFocus()
+
+    def cancel_find(self):
+        if self.find_search: self.find_search.cancel()
+        self.find_search = None
+
+    # First line of the live view in search numbering, which counts from the oldest spilled line
+    def live_base(self):
+        return self.spill.lines if self.spill is not None else 0
+
+    # Restarted on every keystroke; a cancelled search's late batches are ignored
+    def start_find(self, *_):
+        self.cancel_find()
+        self.find_segments, self.find_current = [], None
+        query = self.find_input.text()
+        if query:
+            try: pattern = ScrollbackSearch.compile(query)
+            except re.error:
+                self.find_status.setText("bad regex")
+                self.update_marks()
+                return
+            live = self.txt.screen.snapshot() if self.grid else self.txt.toPlainText()
+            self.find_search = ScrollbackSearch(pattern, live, self.spill,
+                                                self.waker.search_batch.emit, self.waker.search_done.emit)
+        self.show_find_status()
+        self.update_marks()
+
+    def add_find_batch(self, search, batch):
+        if search is not self.find_search: return
+        self.find_segments.append(batch)
+        # Batches arrive newest first; jump to the newest hit if it is on screen already
+        if self.find_current is None:
+            self.find_current = batch[2][-1]
+            if self.find_current[0] >= self.live_base(): self.goto_match(self.find_current)
+        self.show_find_status()
+        self.update_marks()
+
+    def show_find_status(self):
+        search = self.find_search
+        if search is None:
+            self.find_status.setText("")
+            return
+        count = sum(len(b[2]) for b in self.find_segments)
+        running = not search.done
+        self.find_status.setText(f"{count:,}{'+' if search.capped else ''} matches{' …' if running else ''}" if count or running else "no matches")
+
+    def find_step(self, older):
+        cur = self.find_current
+        if cur is None: return
+        best = None
+        for _, _, matches in self.find_segments:
+            if older:
+                i = bisect_left(matches, cur[:2]) - 1
+                if i >= 0 and (best is None or matches[i] > best): best = matches[i]
+            else:
+                i = bisect_right(matches, cur)
+                if i < len(matches) and (best is None or matches[i] < best): best = matches[i]
+        if best is not None:
+            self.find_current = best
+            self.goto_match(best)
+
+    def goto_match(self, match):
+        line, col, _ = match
+        # Spilled history is paged back in until the match is part of the view
+        while self.spill and line < self.spill.lines: self.page_in_chunk()
+        line -= self.live_base()
+        if self.grid:
+            screen = self.txt.screen
+            row, _ = screen.locate(screen.line_starts(), line, col)
+            self.sb.setValue(row - self.txt.visible_rows() // 2)
+        else:
+            block = self.txt.document().findBlockByNumber(line)
+            cursor = QTextCursor(block)
+            cursor.setPosition(block.position() + min(col, block.length() - 1))
+            self.sb.setValue(self.sb.value() + self.txt.cursorRect(cursor).center().y() - self.txt.viewport().height() // 2)
+        self.update_marks()
+
+    # Matches on lines lo..hi, from the segments that overlap them
+    def matches_between(self, lo, hi):
+        for first, last, matches in self.find_segments:
+            if last < lo or first > hi: continue
+            i = bisect_left(matches, (lo,))
+            while i < len(matches) and matches[i][0] <= hi:
+                yield matches[i]
+                i += 1
+
+    # Highlights only the hits inside the viewport; called on scroll, new output and new results
+    def update_marks(self, *_):
+        base = self.live_base()
+        if self.grid:
+            view, marks = self.txt, []
+            if self.find_segments:
+                screen, first = view.screen, self.sb.value()
+                last = first + view.visible_rows()
+                starts = screen.line_starts()
+                lo, hi = bisect_right(starts, first) - 1, bisect_right(starts, last) - 1
+                for match in self.matches_between(base + lo, base + hi):
+                    row, col = screen.locate(starts, match[0] - base, match[1])
+                    if first <= row <= last:
+                        marks.append((row, col, min(col + match[2], max(len(screen.rows[row]), col + 1)), match == self.find_current))
+            view.set_marks(marks)
+            return
+        if not self.find_segments and not self.txt.extraSelections(): return
+        selections = []
+        if self.find_segments:
+            doc, viewport = self.txt.document(), self.txt.viewport()
+            top = self.txt.cursorForPosition(QPoint(0, 0)).blockNumber()
+            bottom = self.txt.cursorForPosition(QPoint(0, viewport.height())).blockNumber()
+            for match in self.matches_between(base + top, base + bottom):
+                block = doc.findBlockByNumber(match[0] - base)
+                sel = QTextEdit.ExtraSelection()
+                sel.cursor = QTextCursor(block)
+                sel.cursor.setPosition(block.position() + match[1])
+                sel.cursor.setPosition(block.position() + min(match[1] + match[2], block.length() - 1), QTextCursor.MoveMode.KeepAnchor)
+                fmt = QTextCharFormat()
+                fmt.setBackground(QColor(255, 140, 0, 170) if match == self.find_current else QColor(255, 200, 0, 90))
+                sel.format = fmt
+                selections.append(sel)
+        self.txt.setExtraSelections(selections)
+
+    def send_cmd(self):
+        cmd = self.input.text()
+        if cmd in ['clear', 'cls']:
+            self.clear_screen()
+        elif cmd:
+            if not self.send_lines([cmd]): return
+            self.app.history.append(cmd)
+        self.reset_recall()
+        self.input.clear()
+        self.update_prompt()
+
+    # Up/Down walk through earlier commands that start with what was typed before the first Up
+    def recall_history(self, step):
+        if self.recall is None:
+            if step < 0: return
+            self.app.history.refresh()
+            self.temp_input = self.input.text()
+            self.recall = self.app.history.prefix_matches(self.temp_input)
+        idx = self.history_idx + step
+        if idx >= len(self.recalled):
+            cmd = next(self.recall, None)
+            if cmd is None: return
+            self.recalled.append(cmd)
+        self.history_idx = max(idx, -1)
+        self.input.setText(self.recalled[self.history_idx] if self.history_idx >= 0 else self.temp_input)
+
+    def reset_recall(self, *_):
+        self.recall, self.recalled, self.history_idx = None, [], -1
+
+    # Ctrl+R: typing refines the query, Ctrl+R again steps to the next older match
+    def search_history(self, query=None):
+        if self.search_query is None:
+            self.app.history.refresh()
+            self.temp_input = self.input.text()
+            query = ''
+        if query is not None:
+            self.search_query, self.search_results = query, self.app.history.search(query)
+        match = next(self.search_results, None)
+        if match is not None: self.input.setText(match)
+        failed = 'failed ' if match is None and self.search_query else ''
+        self.prompt.setText(f"({failed}reverse-i-search)`{self.search_query}':")
+
+    def end_search(self, accept):
+        if not accept: self.input.setText(self.temp_input)
+        self.search_query = self.search_results = None
+        self.reset_recall()
+        self.update_prompt()
+
+    # Keys while searching; anything that isn't editing the query leaves the search with the match
+    def search_key(self, event):
+        key, ctrl = event.key(), event.modifiers() == Qt.KeyboardModifier.ControlModifier
+        if ctrl and key == Qt.Key.Key_R: self.search_history()
+        elif key == Qt.Key.Key_Escape or (ctrl and key == Qt.Key.Key_G): self.end_search(False)
+        elif key == Qt.Key.Key_Backspace: self.search_history(self.search_query[:-1])
+        elif event.text() and event.text().isprintable() and not ctrl: self.search_history(self.search_query + event.text())
+        else:
+            self.end_search(True)
+            return False
+        return True
+
+    # Hands lines to the shell's input queue; when it is full the input is kept for another try
+    def send_lines(self, lines):
+        if not self.pm.write_many(lines):
+            self.prompt.setText(f"{self.get_pwd()}  input queue full")
+            return False
+        if self.pm.cwd_link:
+            self.cwd_delay = self.CWD_POLL_MIN
+            self.cwd_timer.start(self.cwd_delay)
+        return True
+
+    def update_prompt(self):
+        sent, total = self.pm.input_progress()
+        label = self.get_pwd()
+        if sent < total and total >= self.PROGRESS_MIN: label += f"  sending {sent * 100 // total}%"
+        if self.pm.recorder: label += "  ● rec"
+        self.prompt.setText(label)
+        self.app.update_tab_title(self)
+
+    def check_cwd(self):
+        if self.pm.poll_cwd(): self.update_prompt()
+        if self.pm.busy():
+            self.cwd_delay = min(self.cwd_delay * 2, self.CWD_POLL_MAX)
+            self.cwd_timer.start(self.cwd_delay)
+
+    def report_cwd(self, url):
+        self.pm.report_cwd(url)
+        self.update_prompt()
+
+    def schedule_frame(self):
+        self.scheduler.request(self)
+
+    # False for a background tab as well as for a minimized or covered window
+    def output_visible(self):
+        handle = self.window().windowHandle()
+        return self.isVisible() and not self.window().isMinimized() and (handle is None or handle.isExposed())
+
+    def update_output(self, budget=None):
+        # Nothing is drawn while hidden, but the shell must not stall on a full queue: a fast-forwarding
+        # queue drops old output itself, and otherwise all but a screenful goes straight to the spill.
+        # Without a spill the output is rendered unseen, as when shown.
+        self.pm.notified = False
+        q = self.pm.output_queue
+        if not self.output_visible():
+            self.flush_pending = True
+            if q.policy == 'fast_forward': return
+            if self.spill is not None:
+                self.hold_hidden()
+                return
+        elif self.flush_pending:
+            # A view emptied into the spill gets its last page of history back, to scroll up into
+            if self.held and self.spill and self.line_count() <= 1 and not self.txt.toPlainText(): self.page_in_chunk()
+            # Held output is older than anything queued; nobody saw what piled up, so a fast-forwarding queue keeps its tail
+            while self.held: q.unget(self.held.pop()[0])
+            self.held_lines = 0
+            if q.policy == 'fast_forward': q.fast_forward()
+            self.flush_pending = False
+        if self.trim_pending:
+            # Evicting is a pass over the whole document whatever the amount, so it gets a frame to itself
+            self.trim_pending = False
+            self.trim_scrollback(self.sb.maximum() - self.sb.value() <= self.sb.singleStep())
+            if not q.empty(): self.schedule_frame()
+            return
+        if not q.empty():
+            start = time.perf_counter()
+            metrics = self.pm.metrics
+            if metrics.enabled:
+                metrics.gauge('queue_bytes', q.size)
+                metrics.gauge('queue_chunks', q.qsize())
+            following = self.sb.maximum() - self.sb.value() <= self.sb.singleStep()
+            limit = self.frame_bytes
+            batch, size, lines = [], 0, 0
+            while size < limit:
+                try: runs, n, nl = q.get_nowait()
+                except queue.Empty: break
+                if n > limit - size:
+                    # The rest goes back to the front of the queue, where a fast-forward can still skip it
+                    runs, rest = split_runs(runs, int(limit - size))
+                    q.unget(rest)
+                    n, nl = runs_size(runs)
+                batch += runs
+                size += n
+                lines += nl
+            if metrics.enabled: insert_start = time.perf_counter()
+            self.render_batch(batch)
+            if metrics.enabled: metrics.time('insert_ms', (time.perf_counter() - insert_start) * 1000)
+            if self.app.awaiting_prompt: self.app.first_prompt()
+            self.trim_pending = self.excess_lines(following) > 0
+            if self.find_segments: self.update_marks()
+            elapsed = time.perf_counter() - start
+            # Size the next frame from this frame's throughput so rendering stays within this session's share of the budget
+            rate = size / max(elapsed, 1e-6)
+            self.frame_bytes = int(min(max(rate * (budget or self.scheduler.FRAME_BUDGET), self.MIN_FRAME_BYTES), self.MAX_FRAME_BYTES))
+            self.frame_stats = {'lines': lines, 'bytes': size, 'ms': elapsed * 1000, 'pending': q.qsize(), 'pending_bytes': q.size}
+            if metrics.enabled:
+                metrics.time('frame_ms', elapsed * 1000)
+                metrics.count('frames')
+                metrics.count('bytes_out', size)
+                metrics.count('lines_out', lines)
+                if elapsed * 1000 > self.REFRESH_MS: metrics.count('dropped_frames')
+            if self.trim_pending or not q.empty(): self.schedule_frame()
+
+            # Only show scrollbar after 250 lines
+            policy = Qt.ScrollBarPolicy.ScrollBarAlwaysOn if self.line_count() > 250 else Qt.ScrollBarPolicy.ScrollBarAlwaysOff
+            if self.txt.verticalScrollBarPolicy() != policy: self.txt.setVerticalScrollBarPolicy(policy)
+
+    # Drains the queue of a hidden session, keeping a screenful of its tail to draw when shown
+    def hold_hidden(self):
+        q, held, size = self.pm.output_queue, self.held, 0
+        while size < self.MAX_FRAME_BYTES:
+            try: item = q.get_nowait()
+            except queue.Empty: break
+            held.append(item)
+            size += item[1]
+            self.held_lines += item[2]
+        older = []
+        while len(held) > 1 and self.held_lines - held[0][2] >= self.pm.size[1]:
+            runs, _, lines = held.popleft()
+            self.held_lines -= lines
+            older += runs
+        if older:
+            # The spill only grows at its newest end, so the view goes first
+            if self.line_count() > 1 or self.txt.toPlainText(): self.spill_pages(self.evict_view())
+            self.spill_pages(self.spill_text(older))
+        if not q.empty(): self.schedule_frame()
+
+    # Pushes text in pieces no bigger than what trimming evicts, so paging one back in stays cheap
+    def spill_pages(self, text):
+        lines, step = text.splitlines(True), max(self.scrollback_lines // 10, 100)
+        for i in range(0, len(lines), step): self.spill.push(''.join(lines[i:i + step]))
+
+    def evict_view(self):
+        if self.grid: return self.txt.evict(self.line_count())
+        cursor = QTextCursor(self.txt.document())
+        cursor.select(QTextCursor.SelectionType.Document)
+        text = cursor.selection().toPlainText() + '\n'
+        cursor.removeSelectedText()
+        return text
+
+    # Hidden output as plain text: a carriage return restarts its line, so a progress bar keeps only its
+    # last state, and a clear drops what came before it
+    def spill_text(self, runs):
+        parts = []
+        for val, style in runs:
+            if val is not None: parts.append(val)
+            elif style[0] == '\r': parts.append('\r')
+            elif style[0] == 'cwd': self.report_cwd(*style[1])
+            elif style[0] == '\f' or style == ('J', (3,)):
+                parts = []
+                self.clear_screen()
+        text = ''.join(parts)
+        return OVERWRITTEN.sub('', text) if '\r' in text else text
+
+    # Takes runs parsed on the reader thread: (text, style) and (None, (op, args)) entries
+    def render_batch(self, runs):
+        # A form feed clears the screen, so only what follows the last one is drawn
+        for i in range(len(runs) - 1, -1, -1):
+            if runs[i][0] is None and runs[i][1][0] == '\f':
+                self.clear_screen()
+                runs = runs[i + 1:]
+                break
+
+        if not runs: return
+
+        if self.grid:
+            screen = self.txt.screen
+            for val, style in runs:
+                if val is None:
+                    if style[0] == 'cwd': self.report_cwd(*style[1])
+                    else:
+                        if style == ('J', (3,)) and self.spill is not None: self.spill.clear()
+                        screen.control(*style)
+                else: screen.write(val, style if self.show_colors else 0)
+            self.txt.refresh()
+            return
+
+        following = self.sb.value() >= self.sb.maximum() - self.sb.singleStep()
+        cursor = self.term_cursor
+        cursor.beginEditBlock()
+        self.insert_runs(runs, cursor)
+        cursor.endEditBlock()
+        if following: self.sb.setValue(self.sb.maximum())
+
+    def line_count(self):
+        return len(self.txt.screen) if self.grid else self.txt.document().blockCount()
+
+    # Lines due for the spill: evicted in chunks, leaving paged-in history alone while the user is reading it
+    def excess_lines(self, following=True):
+        if self.spill is None: return 0
+        excess = self.line_count() - self.scrollback_lines
+        if excess < max(self.scrollback_lines // 10, 100): return 0
+        if not following and excess < self.scrollback_lines: return 0
+        return excess
+
+    # At most a scrollback's worth per call; what is left is due again after the next frame
+    def trim_scrollback(self, following=True):
+        excess = min(self.excess_lines(following), self.scrollback_lines)
+        if not excess: return
+        if self.grid:
+            self.spill.push(self.txt.evict(excess))
+            return
+        doc = self.txt.document()
+        cursor = QTextCursor(doc)
+        cursor.setPosition(doc.findBlockByNumber(excess).position(), QTextCursor.MoveMode.KeepAnchor)
+        self.spill.push(cursor.selectedText().replace('\u2029', '\n'))
+        cursor.removeSelectedText()
+
+    def page_in_scrollback(self, value):
+        if value != self.sb.minimum() or not self.spill: return
+        old_max = self.sb.maximum()
+        self.page_in_chunk()
+        self.sb.setValue(self.sb.maximum() - old_max)
+
+    def page_in_chunk(self):
+        if self.grid: self.txt.prepend_text(self.spill.pop())
+        else: QTextCursor(self.txt.document()).insertText(self.spill.pop())
+
+    def eventFilter(self, obj, event):
+        if obj == self.find_input and event.type() == QEvent.Type.KeyPress:
+            if event.key() == Qt.Key.Key_Escape: self.close_find()
+            elif event.key() in (Qt.Key.Key_Return, Qt.Key.Key_Enter):
+                # Enter walks up to older hits, Shift+Enter back down
+                self.find_step(not event.modifiers() & Qt.KeyboardModifier.ShiftModifier)
+            else: return super().eventFilter(obj, event)
+            return True
+        if obj == self.input and event.type() == QEvent.Type.KeyPress:
+            if self.search_query is not None and self.search_key(event): return True
+            if event.key() == Qt.Key.Key_R and event.modifiers() == Qt.KeyboardModifier.ControlModifier:
+                self.search_history()
+                return True
+            if event.key() in (Qt.Key.Key_Up, Qt.Key.Key_Down) and not event.modifiers():
+                self.recall_history(1 if event.key() == Qt.Key.Key_Up else -1)
+                return True
+            if event.key() == Qt.Key.Key_C and event.modifiers() == Qt.KeyboardModifier.ControlModifier and not self.input.hasSelectedText():
+                self.pm.interrupt()
+                return True
+            if event.matches(QKeySequence.StandardKey.Paste):
+                # A multi-line paste goes to the shell line by line instead of being flattened into the input
+                text = QApplication.clipboard().text()
+                if '\n' in text.rstrip('\n'):
+                    if self.send_lines((self.input.text() + text).splitlines()): self.input.clear()
+                    return True
+            return super().eventFilter(obj, event)
+        if (obj == self.txt or obj == self.txt.viewport()) and event.type() == QEvent.Type.MouseMove:
+            pos = event.pos()
+            if obj == self.txt.viewport():
+                # Map viewport pos to text edit pos if needed, but width check is enough
+                x = pos.x()
+                distance_from_right = self.txt.viewport().width() - x
+            else:
+                distance_from_right = self.txt.width() - pos.x()
+
+            if distance_from_right < 60 and self.line_count() > 250:
+                if self.sb_anim.endValue() != 1.0 or self.sb_anim.state() == QPropertyAnimation.State.Stopped:
+                    self.sb_anim.stop()
+                    self.sb_anim.setEndValue(1.0)
+                    self.sb_anim.start()
+                    self.sb.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents, False)
+            else:
+                if self.sb_anim.endValue() != 0.0 or self.sb_anim.state() == QPropertyAnimation.State.Stopped:
+                    self.sb_anim.stop()
+                    self.sb_anim.setEndValue(0.0)
+                    self.sb_anim.start()
+                    self.sb.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents, True)
+        return super().eventFilter(obj, event)
+
+    def insert_runs(self, runs, cursor=None):
+        if cursor is None: cursor = self.term_cursor
+
+        formats = self.formats
+        for val, style in runs:
+            if val is None:
+                if style[0] == 'cwd': self.report_cwd(*style[1])
+                else: self.apply_control(cursor, *style)
+                continue
+            if not self.show_colors: style = 0
+            fmt = formats.get(style)
+            if fmt is None: fmt = self.char_format(style)
+            if cursor.atEnd(): cursor.insertText(val, fmt)
+            else: self.overwrite(cursor, val, fmt)
+
+    def overwrite(self, cursor, text, fmt):
+        for i, line in enumerate(text.split('\n')):
+            if i:
+                if cursor.block().next().isValid(): cursor.movePosition(QTextCursor.MoveOperation.NextBlock)
+                else:
+                    cursor.movePosition(QTextCursor.MoveOperation.End)
+                    cursor.insertText('\n', fmt)
+            if not line: continue
+            n = min(len(line), cursor.block().length() - 1 - cursor.positionInBlock())
+            if n > 0: cursor.movePosition(QTextCursor.MoveOperation.Right, QTextCursor.MoveMode.KeepAnchor, n)
+            cursor.insertText(line, fmt)
+
+    def goto_column(self, cursor, col):
+        cursor.movePosition(QTextCursor.MoveOperation.StartOfBlock)
+        length = cursor.block().length() - 1
+        if col > length:
+            cursor.movePosition(QTextCursor.MoveOperation.EndOfBlock)
+            cursor.insertText(' ' * (col - length), self.formats.get(0) or self.char_format(0))
+        else:
+            cursor.movePosition(QTextCursor.MoveOperation.Right, n=col)
+
+    def goto_line(self, cursor, line):
+        doc = self.txt.document()
+        if line >= doc.blockCount():
+            cursor.movePosition(QTextCursor.MoveOperation.End)
+            cursor.insertText('\n' * (line - doc.blockCount() + 1))
+        else:
+            cursor.setPosition(doc.findBlockByNumber(line).position())
+
+    # Cursor addressing is confined to the last screenful of lines, like a real terminal
+    def apply_control(self, cursor, op, args):
+        M, keep = QTextCursor.MoveOperation, QTextCursor.MoveMode.KeepAnchor
+        n = args[0] if args and args[0] else 1
+        mode = args[0] if args else 0
+        col, line = cursor.positionInBlock(), cursor.blockNumber()
+        rows, count = self.pm.size[1], self.txt.document().blockCount()
+        top = max(count - rows, 0)
+        if op == '\r': cursor.movePosition(M.StartOfBlock)
+        elif op == '\x08':
+            if col: cursor.movePosition(M.Left)
+        elif op == 'K':
+            if mode == 0:
+                cursor.movePosition(M.EndOfBlock, keep)
+                cursor.removeSelectedText()
+            else:
+                end = cursor.block().length() - 1 if mode == 2 else min(col + 1, cursor.block().length() - 1)
+                cursor.movePosition(M.StartOfBlock)
+                cursor.movePosition(M.Right, keep, end)
+                cursor.insertText(' ' * end, self.formats.get(0) or self.char_format(0))
+                self.goto_column(cursor, col)
+        elif op in 'ABEF':
+            self.goto_line(cursor, max(line - n, top) if op in 'AF' else min(line + n, count - 1))
+            self.goto_column(cursor, 0 if op in 'EF' else col)
+        elif op == 'C': self.goto_column(cursor, col + n)
+        elif op == 'D': self.goto_column(cursor, max(col - n, 0))
+        elif op == 'G': self.goto_column(cursor, n - 1)
+        elif op in 'Hf':
+            self.goto_line(cursor, top + n - 1)
+            self.goto_column(cursor, (args[1] if len(args) > 1 and args[1] else 1) - 1)
+        elif op == 'J':
+            if mode == 0:
+                cursor.movePosition(M.End, keep)
+                cursor.removeSelectedText()
+            elif mode == 2:
+                # Scroll the screen into history and continue on a blank one
+                cursor.movePosition(M.End)
+                cursor.insertText('\n' * rows)
+                self.goto_line(cursor, max(self.txt.document().blockCount() - rows, 0) + line - top)
+                self.goto_column(cursor, col)
+            elif mode == 3:
+                if self.spill is not None: self.spill.clear()
+                cursor.select(QTextCursor.SelectionType.Document)
+                cursor.removeSelectedText()
+
+    def style_colors(self, style):
+        fg, bg = self.pm.palette.resolve(style)
+        color = None
+        if fg:
+            color = QColor(fg)
+            if style & DIM: color.setAlpha(150)
+        return color, QColor(bg) if bg else None
+
+    def char_format(self, style):
+        fmt = self.formats[style] = QTextCharFormat()
+        fg, bg = self.style_colors(style)
+        if fg is not None: fmt.setForeground(fg)
+        if bg is not None: fmt.setBackground(bg)
+        if style & BOLD: fmt.setFontWeight(QFont.Weight.Bold)
+        if style & ITALIC: fmt.setFontItalic(True)
+        if style & UNDERLINE: fmt.setFontUnderline(True)
+        if style & STRIKE: fmt.setFontStrikeOut(True)
+        return fmt
+
+    # Ends the shell, or with `detach` leaves it to a session server, and drops what the session
+    # holds on disk; the widget is deleted by the window
+    def shutdown(self, detach=False):
+        self.cancel_find()
+        self.cwd_timer.stop()
+        self.overlay_timer.stop()
+        self.pm.metrics.stop_dump()
+        if self.pm.recorder:
+            self.pm.recorder.close()
+            self.pm.recorder = None
+        self.pm.on_output = self.pm.on_input_progress = None
+        if detach: self.pm.detach()
+        else: self.pm.stop()
+        # Dropped, not just closed: the view still scrolls to the top as it is torn down
+        if self.spill is not None: self.spill.close()
+        self.spill = None
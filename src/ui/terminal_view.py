@@ -0,0 +1,175 @@
+from PyQt6.QtWidgets import QAbstractScrollArea, QApplication
+from PyQt6.QtCore import Qt, QPointF, QRectF
+from PyQt6.QtGui import QColor, QFont, QFontMetricsF, QPainter, QStaticText
+
+from ..core.ansi_parser import BOLD, ITALIC, UNDERLINE, STRIKE
+from ..core.screen import Screen
+
+# Paints only the rows of a Screen that are inside the viewport, so paint time depends
+# on the window size rather than on how much history has been written.
+class TerminalView(QAbstractScrollArea):
+    CACHE_LIMIT = 4096
+
+    def __init__(self, style_colors, parent=None):
+        super().__init__(parent)
+        self.screen = Screen()
+        self.style_colors = style_colors  # style -> (fg QColor or None, bg QColor or None)
+        self.styles, self.fonts, self.glyphs = {}, {}, {}
+        self.fg, self.bg, self.sel_bg = QColor('white'), QColor('black'), QColor('#264f78')
+        self.anchor = self.cursor_cell = None
+        self.marks = []  # (row, start, end, current) search hits in view
+        self.mark_bg, self.current_mark_bg = QColor(255, 200, 0, 90), QColor(255, 140, 0, 170)
+        self.verticalScrollBar().setSingleStep(1)
+        self.verticalScrollBar().valueChanged.connect(self.viewport().update)
+        self.viewport().setCursor(Qt.CursorShape.IBeamCursor)
+        self.setFont(self.font())
+
+    def setFont(self, font):
+        super().setFont(font)
+        metrics = QFontMetricsF(font)
+        self.cell_w, self.cell_h = metrics.horizontalAdvance('M'), metrics.lineSpacing()
+        self.fonts.clear()
+        self.glyphs.clear()
+        self.update_geometry()
+
+    def set_colors(self, theme):
+        self.fg, self.bg = QColor(theme['text_color']), QColor(theme['background'])
+        self.sel_bg = QColor(theme['selection_bg'])
+        self.sel_bg.setAlpha(160)
+        self.styles.clear()
+        self.viewport().update()
+
+    def visible_rows(self): return max(int(self.viewport().height() // self.cell_h), 1)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_geometry()
+
+    def update_geometry(self):
+        self.screen.cols = max(int(self.viewport().width() // self.cell_w), 1)
+        self.screen.height = self.visible_rows()
+        self.refresh()
+
+    # Called after writing to the screen: updates the scroll range and follows the tail
+    def refresh(self):
+        sb = self.verticalScrollBar()
+        following = sb.value() >= sb.maximum()
+        visible = self.visible_rows()
+        sb.setRange(0, max(len(self.screen) - visible, 0))
+        sb.setPageStep(visible)
+        if following: sb.setValue(sb.maximum())
+        self.viewport().update()
+
+    def clear(self):
+        self.screen.clear()
+        self.anchor = self.cursor_cell = None
+        self.refresh()
+
+    def toPlainText(self): return self.screen.text()
+
+    def evict(self, n):
+        text = self.screen.evict(n)
+        self.shift_selection(-n)
+        self.refresh()
+        return text
+
+    def prepend_text(self, text):
+        self.shift_selection(self.screen.prepend_text(text))
+        self.refresh()
+
+    def shift_selection(self, n):
+        if self.anchor is None: return
+        self.anchor = (max(self.anchor[0] + n, 0), self.anchor[1])
+        if self.cursor_cell: self.cursor_cell = (max(self.cursor_cell[0] + n, 0), self.cursor_cell[1])
+
+    def font_for(self, flags):
+        font = self.fonts.get(flags)
+        if font is None:
+            font = self.fonts[flags] = QFont(self.font())
+            font.setBold(bool(flags & BOLD))
+            font.setItalic(bool(flags & ITALIC))
+            font.setUnderline(bool(flags & UNDERLINE))
+            font.setStrikeOut(bool(flags & STRIKE))
+        return font
+
+    def style_for(self, style):
+        resolved = self.styles.get(style)
+        if resolved is None:
+            fg, bg = self.style_colors(style)
+            resolved = self.styles[style] = (fg or self.fg, bg, self.font_for(style & (BOLD | ITALIC | UNDERLINE | STRIKE)))
+        return resolved
+
+    def glyph_run(self, text, font):
+        key = (text, font.key())
+        run = self.glyphs.get(key)
+        if run is None:
+            if len(self.glyphs) > self.CACHE_LIMIT: self.glyphs.clear()
+            run = self.glyphs[key] = QStaticText(text)
+            run.setTextFormat(Qt.TextFormat.PlainText)
+            run.prepare(font=font)
+        return run
+
+    def paintEvent(self, event):
+        p = QPainter(self.viewport())
+        p.fillRect(event.rect(), self.bg)
+        cw, ch = self.cell_w, self.cell_h
+        first = self.verticalScrollBar().value()
+        rows = self.screen.rows[first:first + self.visible_rows() + 1]
+        for i, row in enumerate(rows):
+            y = i * ch
+            for col, text, style in row.get_runs():
+                fg, bg, font = self.style_for(style)
+                if bg is not None: p.fillRect(QRectF(col * cw, y, len(text) * cw, ch), bg)
+                p.setFont(font)
+                p.setPen(fg)
+                p.drawStaticText(QPointF(col * cw, y), self.glyph_run(text, font))
+        for row, start, end, current in self.marks:
+            p.fillRect(QRectF(start * cw, (row - first) * ch, (end - start) * cw, ch), self.current_mark_bg if current else self.mark_bg)
+        for row, start, end in self.selected_spans(first, first + len(rows)):
+            p.fillRect(QRectF(start * cw, (row - first) * ch, (end - start) * cw, ch), self.sel_bg)
+        p.end()
+
+    def set_marks(self, marks):
+        if marks != self.marks:
+            self.marks = marks
+            self.viewport().update()
+
+    def cell_at(self, pos):
+        row = self.verticalScrollBar().value() + int(pos.y() // self.cell_h)
+        return (min(max(row, 0), len(self.screen) - 1), max(int(round(pos.x() / self.cell_w)), 0))
+
+    def selection(self):
+        if self.anchor is None or self.cursor_cell is None or self.anchor == self.cursor_cell: return None
+        return tuple(sorted((self.anchor, self.cursor_cell)))
+
+    def selected_spans(self, first=0, last=None):
+        sel = self.selection()
+        if sel is None: return
+        (r0, c0), (r1, c1) = sel
+        for row in range(max(r0, first), min(r1, last if last is not None else r1) + 1):
+            start = c0 if row == r0 else 0
+            end = c1 if row == r1 else max(len(self.screen.rows[row]), self.screen.cols)
+            if end > start: yield row, start, end
+
+    def selected_text(self):
+        rows, parts = self.screen.rows, []
+        for row, start, end in self.selected_spans():
+            parts.append(rows[row].text()[start:end])
+            if row != self.selection()[1][0] and not rows[row].wrapped: parts.append('\n')
+        return ''.join(parts)
+
+    def copy(self):
+        text = self.selected_text()
+        if text: QApplication.clipboard().setText(text)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.anchor = self.cursor_cell = self.cell_at(event.position())
+            self.viewport().update()
+        super().mousePressEvent(event)
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.MouseButton.LeftButton and self.anchor is not None:
+            self.cursor_cell = self.cell_at(event.position())
+            self.viewport().update()
+        super().mouseMoveEvent(event)